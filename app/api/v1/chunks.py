@@ -1,22 +1,26 @@
 import os
 import uuid
-from typing import Optional
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+import orjson
 from dotenv import load_dotenv
-from fastapi import File, UploadFile, HTTPException, Depends, Header, APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import File, UploadFile, HTTPException, Depends, Header, APIRouter, Request, Query
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 
 from app.core.external_services.embedding.openai_embedding_adapter import OpenAIEmbeddingModel
 from app.core.services.upload_process import UploadProcess
-from app.core.domain.chunks.chunk_repository import ChunkRepository
+from app.core.domain.chunks.chunk_repository import AsyncChunkRepository, DOCUMENTS_PAGE_SIZE
+from app.core.domain.chunks.chunk_model import SearchMode
 from app.core.domain.upload.pdf_reader_interface import PDFReader
 from app.core.domain.upload.text_splitter_interface import TextSplitter
 from app.exceptions.http_exceptions import HTTPInternalServerError
-from app.models.dto.documents import UploadDocumentRequest, UploadDocumentResponse
+from app.models.dto.search import BatchSearchRequest, BatchSearchResponse, SEARCH_MAX_K
+from app.models.dto.documents import UploadDocumentRequest, UploadDocumentResponse, DocumentChunk, \
+    GetDocumentChunksResponse
 from app.core.domain.upload.pdf_reader_service import PDFReaderService
 from app.core.domain.upload.text_splitter_service import TextSplitterService
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
-from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
-from app.core.external_services.embedding.embedding_port import EmbeddingModel
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
 from app.core.utils.logger import Logger, request_id_var
 
@@ -27,13 +31,16 @@ load_dotenv()
 logger = Logger(name="Logger")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
 VECTOR_STORE_DIMENSION = os.getenv("EMBEDDING_DIMENSIONS")
+DOCUMENTS_MAX_PAGE_SIZE = int(os.getenv("DOCUMENTS_MAX_PAGE_SIZE", 1000))
 
 
 def get_pdf_reader() -> PDFReader:
     return PDFReaderService()
 
 
+@lru_cache(maxsize=1)
 def get_text_splitter() -> TextSplitter:
+    # Shared by all uploads, the sentence splitter keeps its pipeline loaded
     return TextSplitterService(chunk_size=500)
 
 
@@ -45,12 +52,33 @@ def get_embedding_model(api_key: str = Header(..., alias="x-api-key")) -> OpenAI
     )
 
 
-def get_vector_store() -> VectorStore:
-    return VectorStoreQdrant()
+def get_vector_store(request: Request) -> VectorStore:
+    return request.app.state.vector_store
 
 
-def get_chunk_repository(vector_store: VectorStore = Depends(get_vector_store)) -> ChunkRepository:
-    return ChunkRepository(vector_Store=vector_store)
+def get_chunk_repository(vector_store: VectorStore = Depends(get_vector_store)) -> AsyncChunkRepository:
+    return AsyncChunkRepository(vector_Store=vector_store)
+
+
+def chunks_page_response(records, next_page_offset) -> GetDocumentChunksResponse:
+    return GetDocumentChunksResponse(
+        chunks=[DocumentChunk(id=record.id, payload=record.payload) for record in records],
+        nextPageOffset=next_page_offset,
+    )
+
+
+async def stream_chunks(chunk_repository: AsyncChunkRepository, user_id: str, document_id: Optional[str],
+                        page_size: int) -> AsyncIterator[bytes]:
+    """Writes one JSON object per chunk and line, page by page as the scroll pages arrive."""
+    try:
+        async for records in chunk_repository.iter_chunks(user_id=user_id, document_id=document_id,
+                                                          page_size=page_size):
+            yield b"".join(orjson.dumps({"id": record.id, "payload": record.payload}) + b"\n"
+                           for record in records)
+    except Exception as e:
+        # The status code has already been sent, so the export can only end early
+        logger.log(level="error", func_name="stream_chunks", message=f"Export aborted: {e}")
+        raise
 
 
 @router.post("/document", response_model=UploadDocumentResponse)
@@ -61,7 +89,7 @@ async def upload_pdf(
         pdf_reader: PDFReaderService = Depends(get_pdf_reader),
         text_splitter: TextSplitter = Depends(get_text_splitter),
         embedding_model: EmbeddingModel = Depends(get_embedding_model),
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
 ):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
@@ -96,13 +124,13 @@ async def upload_pdf(
 async def delete_document(
         userId: str,
         documentId: str,
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
 ):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
 
     try:
-        response = chunk_repository.delete_chunks(document_id=documentId, user_id=userId)
+        response = await chunk_repository.delete_chunks(document_id=documentId, user_id=userId)
         return JSONResponse(content=response.dict())
     except Exception as e:
         raise HTTPInternalServerError(error=str(e))
@@ -112,45 +140,61 @@ async def delete_document(
 async def delete_document(
         userId: str,
         documentId: Optional[str] = None,
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
 ):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
 
     try:
-        response = chunk_repository.delete_chunks(user_id=userId, document_id=documentId)
+        response = await chunk_repository.delete_chunks(user_id=userId, document_id=documentId)
         return JSONResponse(content=response.dict())
     except Exception as e:
         raise HTTPInternalServerError(error=str(e))
 
 
-@router.get("/api/v1/documents/{userId}")
+@router.get("/api/v1/documents/{userId}", response_model=GetDocumentChunksResponse)
 async def get_documents(
         userId: str,
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        limit: int = Query(DOCUMENTS_PAGE_SIZE, ge=1, le=DOCUMENTS_MAX_PAGE_SIZE),
+        offset: Optional[str] = None,
+        stream: bool = False,
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
 ):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
 
+    if stream:
+        return StreamingResponse(stream_chunks(chunk_repository, user_id=userId, document_id=None, page_size=limit),
+                                 media_type="application/x-ndjson")
+
     try:
-        response = chunk_repository.get_all_chunks(user_id=userId)
-        return response
+        records, next_page_offset = await chunk_repository.get_all_chunks(user_id=userId, limit=limit, offset=offset)
+        return chunks_page_response(records, next_page_offset)
     except Exception as e:
         raise HTTPInternalServerError(error=str(e))
 
 
-@router.get("/api/v1/documents/{userId}/{documentId}")
+@router.get("/api/v1/documents/{userId}/{documentId}", response_model=GetDocumentChunksResponse)
 async def get_document(
         userId: str,
         documentId: str,
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        limit: int = Query(DOCUMENTS_PAGE_SIZE, ge=1, le=DOCUMENTS_MAX_PAGE_SIZE),
+        offset: Optional[str] = None,
+        stream: bool = False,
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
 ):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
 
+    if stream:
+        return StreamingResponse(stream_chunks(chunk_repository, user_id=userId, document_id=documentId,
+                                               page_size=limit),
+                                 media_type="application/x-ndjson")
+
     try:
-        response = chunk_repository.get_chunks(document_id=documentId, user_id=userId)
-        return response
+        records, next_page_offset = await chunk_repository.get_chunks(document_id=documentId, user_id=userId,
+                                                                      limit=limit, offset=offset)
+        return chunks_page_response(records, next_page_offset)
     except Exception as e:
         raise HTTPInternalServerError(error=str(e))
 
@@ -160,8 +204,9 @@ async def search_documents(
         query: str,
         userId: str,
         documentId: Optional[str] = None,
-        k: int = int(os.getenv("MAX_K_RESULTS")),
-        chunk_repository: ChunkRepository = Depends(get_chunk_repository),
+        k: int = Query(int(os.getenv("MAX_K_RESULTS")), ge=1, le=SEARCH_MAX_K),
+        mode: SearchMode = "dense",
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
         embedding_model: EmbeddingModel = Depends(get_embedding_model),
         api_key: str = Header(..., alias="x-api-key"),
 ):
@@ -169,14 +214,43 @@ async def search_documents(
     request_id_var.set(request_id)
 
     try:
-        response = chunk_repository.search_chunks(
+        response = await chunk_repository.search_chunks(
             embedding_model=embedding_model,
             query=query,
             user_id=userId,
             document_id=documentId,
-            k=k
+            k=k,
+            mode=mode
+        )
+
+        # The documents are built without validation, dumping them directly is much cheaper than jsonable_encoder
+        return ORJSONResponse(content=[document.model_dump() for document in response])
+    except Exception as e:
+        raise HTTPInternalServerError(error=str(e))
+
+
+@router.post("/api/v1/documents/search/batch", response_model=BatchSearchResponse)
+async def search_documents_batch(
+        request: BatchSearchRequest,
+        chunk_repository: AsyncChunkRepository = Depends(get_chunk_repository),
+        embedding_model: EmbeddingModel = Depends(get_embedding_model),
+        api_key: str = Header(..., alias="x-api-key"),
+):
+    request_id = str(uuid.uuid4())
+    request_id_var.set(request_id)
+
+    try:
+        results = await chunk_repository.search_chunks_batch(
+            embedding_model=embedding_model,
+            queries=[query.to_chunk_search_query() for query in request.queries],
         )
 
-        return response
+        return ORJSONResponse(content={
+            "requestId": request_id,
+            "results": [
+                {"query": query.query, "relatedDocuments": [document.model_dump() for document in related_documents]}
+                for query, related_documents in zip(request.queries, results)
+            ]
+        })
     except Exception as e:
-        raise HTTPInternalServerError(error=str(e))
\ No newline at end of file
+        raise HTTPInternalServerError(error=str(e))
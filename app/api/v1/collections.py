@@ -1,9 +1,13 @@
 import os
+from typing import Optional
+
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from app.exceptions.http_exceptions import HTTPInternalServerError
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
+from app.core.external_services.database.vector_store.qdrant_profiles import COLLECTION_PROFILES
 from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
+from app.core.external_services.embedding.openai_embedding_adapter import embedding_dimensions
 from app.core.utils.logger import Logger
 
 router = APIRouter()
@@ -13,11 +17,12 @@ logger = Logger(name="Logger")
 load_dotenv()
 
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
-VECTOR_STORE_DIMENSION = os.getenv("EMBEDDING_DIMENSIONS")
+# Vector size of new collections, the dimensions of the embedding model of the uploads
+VECTOR_STORE_DIMENSION = embedding_dimensions(EMBEDDING_MODEL, os.getenv("EMBEDDING_DIMENSIONS"))
 
 
-def get_vector_store() -> VectorStore:
-    return VectorStoreQdrant()
+def get_vector_store(request: Request) -> VectorStore:
+    return request.app.state.vector_store
 
 @router.get("/collections")
 async def get_collections(vector_store: VectorStoreQdrant = Depends(get_vector_store)):
@@ -42,9 +47,15 @@ async def get_collection(collection_name: str, vector_store: VectorStoreQdrant =
 
 
 @router.post("/collections/{collection_name}")
-async def create_collection(collection_name: str, vector_store: VectorStoreQdrant = Depends(get_vector_store)):
+async def create_collection(collection_name: str,
+                            profile: Optional[str] = Query(None, description="low-latency, balanced or memory-lean"),
+                            vector_store: VectorStoreQdrant = Depends(get_vector_store)):
+    if profile is not None and profile not in COLLECTION_PROFILES:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown profile '{profile}'. Available profiles: {', '.join(COLLECTION_PROFILES)}")
+
     try:
-        vector_store.create_collection(collection_name)
+        vector_store.create_collection(collection_name, profile=profile, vector_size=VECTOR_STORE_DIMENSION)
         return {"message": f"Collection '{collection_name}' created successfully."}
     except Exception as e:
         raise HTTPInternalServerError(
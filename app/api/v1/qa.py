@@ -1,13 +1,15 @@
 import os
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 
-from fastapi import APIRouter, Depends, Header, Query
+import orjson
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
 
-from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
 from app.core.external_services.embedding.openai_embedding_adapter import OpenAIEmbeddingModel
 from app.core.external_services.llm.openai_llm_adapter import OpenAILLMModel
 from app.core.services.qa_process import QAProcess
-from app.core.domain.qa.qa_models import QAHistoryMessage
+from app.core.domain.qa.qa_chain_factory import RetrieverType
+from app.core.domain.qa.qa_models import QAHistoryMessage, QALLMResponse
 from app.core.domain.qa.qa_prompts_interface import QAPromptsInterface
 from app.core.domain.qa.qa_prompts_service import QAPromptsService
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
@@ -23,6 +25,8 @@ router = APIRouter()
 
 logger = Logger(name="Logger")
 
+MMR_MAX_FETCH_K = int(os.getenv("MMR_MAX_FETCH_K", 200))
+
 
 def get_embedding_model(api_key: str = Header(..., alias="x-api-key")) -> EmbeddingModel:
     return OpenAIEmbeddingModel(
@@ -32,8 +36,8 @@ def get_embedding_model(api_key: str = Header(..., alias="x-api-key")) -> Embedd
     )
 
 
-def get_vector_store() -> VectorStore:
-    return VectorStoreQdrant()
+def get_vector_store(request: Request) -> VectorStore:
+    return request.app.state.vector_store
 
 
 def get_llm(api_key: str = Header(..., alias="x-api-key")) -> LlmModel:
@@ -45,8 +49,33 @@ def get_retriever(embedding_model: EmbeddingModel = Depends(get_embedding_model)
     return QdrantRetriever(vector_store, embedding_model)
 
 
+# The prompt templates are built once and the chains built from them are cached by the QAChainFactory
+PROMPTS = QAPromptsService()
+
+
 def get_prompts() -> QAPromptsInterface:
-    return QAPromptsService()
+    return PROMPTS
+
+
+def sse_event(event: str, data) -> bytes:
+    # Data is JSON encoded, so tokens with line breaks stay within one data line
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def stream_qa_events(events: AsyncIterator) -> AsyncIterator[bytes]:
+    """Sends a token event per answer token, then the related documents and a final done event."""
+    try:
+        async for event in events:
+            if isinstance(event, QALLMResponse):
+                yield sse_event("documents", [document.model_dump() for document in event.related_documents])
+            else:
+                yield sse_event("token", event)
+    except Exception as e:
+        # The status code has already been sent, so the error is reported as an event
+        logger.log(level="error", func_name="POST /qa/stream", message=str(e))
+        yield sse_event("error", {"error": str(e)})
+        return
+    yield sse_event("done", None)
 
 
 @router.post("/qa", response_model=QAResponse)
@@ -57,6 +86,10 @@ async def qa_request(
         owner_id: str = Query(..., alias="ownerId"),
         conversation_id: str = Query(..., alias="conversationId"),
         document_id: Optional[str] = Query(None, alias="documentId"),
+        fetch_k: Optional[int] = Query(None, alias="fetchK", ge=1, le=MMR_MAX_FETCH_K),
+        lambda_mult: Optional[float] = Query(None, alias="lambdaMult", ge=0, le=1),
+        retriever_type: Optional[RetrieverType] = Query(None, alias="retrieverType"),
+        rerank: Optional[bool] = Query(None, alias="rerank"),
         llm: LlmModel = Depends(get_llm),
         retriever: Retriever = Depends(get_retriever),
         prompts: QAPromptsInterface = Depends(get_prompts),
@@ -80,7 +113,11 @@ async def qa_request(
         query=query,
         document_id=document_id,
         conversation_id=conversation_id,
-        chat_history=chat_history
+        chat_history=chat_history,
+        fetch_k=fetch_k,
+        lambda_mult=lambda_mult,
+        retriever_type=retriever_type,
+        rerank=rerank
         # api_key=api_key,
     )
 
@@ -92,3 +129,44 @@ async def qa_request(
         )
     '''
 
+
+@router.post("/qa/stream")
+async def qa_stream_request(
+        chat_history: List[QAHistoryMessage],
+        api_key: str = Header(..., alias="x-api-key"),
+        query: str = Query(..., alias="query"),
+        owner_id: str = Query(..., alias="ownerId"),
+        conversation_id: str = Query(..., alias="conversationId"),
+        document_id: Optional[str] = Query(None, alias="documentId"),
+        fetch_k: Optional[int] = Query(None, alias="fetchK", ge=1, le=MMR_MAX_FETCH_K),
+        lambda_mult: Optional[float] = Query(None, alias="lambdaMult", ge=0, le=1),
+        retriever_type: Optional[RetrieverType] = Query(None, alias="retrieverType"),
+        rerank: Optional[bool] = Query(None, alias="rerank"),
+        llm: LlmModel = Depends(get_llm),
+        retriever: Retriever = Depends(get_retriever),
+        prompts: QAPromptsInterface = Depends(get_prompts),
+):
+    logger.log(level="debug", func_name="POST /qa/stream", message="Streaming QA request received")
+
+    if document_id == "undefined":
+        document_id = None
+    chat_history = ChatHistory(messages=chat_history)
+
+    events = QAProcess.stream_process(
+        llm=llm,
+        retriever=retriever,
+        prompts=prompts,
+        user_id=owner_id,
+        query=query,
+        document_id=document_id,
+        conversation_id=conversation_id,
+        chat_history=chat_history,
+        fetch_k=fetch_k,
+        lambda_mult=lambda_mult,
+        retriever_type=retriever_type,
+        rerank=rerank
+    )
+
+    return StreamingResponse(stream_qa_events(events),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,21 +1,27 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+from qdrant_client import models
 
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
-from app.core.domain.chunks.chunk_model import ChunkModel
+from app.core.domain.chunks.chunk_model import ChunkLike, ChunkIngestionReport, ChunkSearchQuery, SearchMode
 
 
 class ChunkInterface(ABC):
     @abstractmethod
-    def add_chunks(self, chunks: List[ChunkModel], embedding_model: EmbeddingModel) -> None:
+    def add_chunks(self, chunks: List[ChunkLike], embedding_model: EmbeddingModel) -> ChunkIngestionReport:
         pass
 
     @abstractmethod
-    def get_chunks(self, user_id: str, document_id: str) -> List[ChunkModel]:
+    def get_chunks(self, user_id: str, document_id: str, limit: int,
+                   offset: Optional[models.ExtendedPointId] = None
+                   ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
         pass
 
     @abstractmethod
-    def get_all_chunks(self, user_id):
+    def get_all_chunks(self, user_id: str, limit: int,
+                       offset: Optional[models.ExtendedPointId] = None
+                       ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
         pass
 
     @abstractmethod
@@ -28,5 +34,57 @@ class ChunkInterface(ABC):
                       query: str,
                       user_id: str,
                       document_id: Optional[str] = None,
-                      k: int = 5):
-        pass
\ No newline at end of file
+                      k: int = 5,
+                      mode: SearchMode = "dense"):
+        pass
+
+
+class AsyncChunkInterface(ABC):
+    @abstractmethod
+    async def add_chunks(self, chunks: List[ChunkLike], embedding_model: EmbeddingModel) -> ChunkIngestionReport:
+        pass
+
+    @abstractmethod
+    async def get_chunks(self, user_id: str, document_id: str, limit: int,
+                         offset: Optional[models.ExtendedPointId] = None
+                         ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        pass
+
+    @abstractmethod
+    async def get_all_chunks(self, user_id: str, limit: int,
+                             offset: Optional[models.ExtendedPointId] = None
+                             ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        pass
+
+    @abstractmethod
+    def iter_chunks(self, user_id: str, document_id: Optional[str] = None,
+                    page_size: int = 100) -> AsyncIterator[List[models.Record]]:
+        pass
+
+    @abstractmethod
+    async def delete_chunks(self, user_id: str, document_id: Optional[str] = None):
+        pass
+
+    @abstractmethod
+    async def delete_stale_chunks(self, user_id: str, document_id: str, keep_ids: Set[str]):
+        pass
+
+    @abstractmethod
+    async def delete_chunk_ids(self, user_id: str, document_id: str, point_ids: Set[str]):
+        pass
+
+    @abstractmethod
+    async def search_chunks(self,
+                            embedding_model: EmbeddingModel,
+                            query: str,
+                            user_id: str,
+                            document_id: Optional[str] = None,
+                            k: int = 5,
+                            mode: SearchMode = "dense"):
+        pass
+
+    @abstractmethod
+    async def search_chunks_batch(self,
+                                  embedding_model: EmbeddingModel,
+                                  queries: List[ChunkSearchQuery]):
+        pass
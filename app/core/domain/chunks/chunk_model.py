@@ -1,7 +1,18 @@
+from dataclasses import dataclass
+from typing import List, Literal, Optional, Union
+
 from pydantic import BaseModel, PositiveInt, Field, field_validator
 from app.exceptions.exceptions import InvalidOwnerIdError, InvalidDocumentIdError, InvalidConversationIdError
 from app.core.domain.chunks.chunk_exceptions import InvalidContentError, InvalidPageNumberError
 
+CONTENT_MIN_LENGTH = 10
+CONTENT_MAX_LENGTH = 10000
+
+
+def clean_content(value: str) -> str:
+    """Removes unwanted characters. Chained str.replace is faster than str.translate or a regex for these patterns."""
+    return value.replace("\n\n", " ").replace("\n", " ").replace("\"", "").replace("  ", " ")
+
 
 class ChunkMetadata(BaseModel):
     document_id: str = Field(strict=True)
@@ -36,7 +47,8 @@ class ChunkMetadata(BaseModel):
 
 
 class ChunkModel(BaseModel):
-    content: str = Field(min_length=10, max_length=10000, strict=True, description="The content of the chunk")
+    content: str = Field(min_length=CONTENT_MIN_LENGTH, max_length=CONTENT_MAX_LENGTH, strict=True,
+                         description="The content of the chunk")
     metadata: ChunkMetadata = Field(strict=True, description="The metadata of the chunk")
 
     @field_validator('content', mode='before')
@@ -45,10 +57,80 @@ class ChunkModel(BaseModel):
         # Validate content
         if not isinstance(value, str):
             raise InvalidContentError()
-        if len(value) < 10:
+        if len(value) < CONTENT_MIN_LENGTH:
             raise InvalidContentError("Content must be at least 10 characters long")
 
         # Remove unwanted characters
-        value = value.replace("\n\n", " ").replace("\n", " ").replace("\"", "").replace("  ", " ")
+        return clean_content(value)
 
-        return value
+
+@dataclass(slots=True)
+class ChunkRecordMetadata:
+    document_id: str
+    conversation_id: str
+    owner_id: str
+    page_number: int
+    on_page_index: int
+
+
+@dataclass(slots=True)
+class ChunkRecord:
+    """
+    Compact chunk for the ingestion path, without pydantic validation. The ids come from a validated request, so
+    only the content is checked and cleaned, with the same rules as ChunkModel. Chunks returned by the API stay
+    ChunkModel objects.
+    """
+    content: str
+    metadata: ChunkRecordMetadata
+
+    @classmethod
+    def create(cls, content: str, document_id: str, conversation_id: str, owner_id: str, page_number: int,
+               on_page_index: int) -> "ChunkRecord":
+        if len(content) < CONTENT_MIN_LENGTH:
+            raise InvalidContentError("Content must be at least 10 characters long")
+        content = clean_content(content)
+        if not CONTENT_MIN_LENGTH <= len(content) <= CONTENT_MAX_LENGTH:
+            raise InvalidContentError(f"Content must be {CONTENT_MIN_LENGTH} to {CONTENT_MAX_LENGTH} characters long")
+        return cls(content, ChunkRecordMetadata(document_id, conversation_id, owner_id, page_number, on_page_index))
+
+
+# Anything with the content and metadata attributes of a chunk
+ChunkLike = Union[ChunkModel, ChunkRecord]
+
+
+# Dense vector search, or dense and sparse (BM25) search fused with reciprocal rank fusion
+SearchMode = Literal["dense", "hybrid"]
+
+
+class ChunkSearchQuery(BaseModel):
+    query: str
+    user_id: str
+    document_id: Optional[str] = None
+    k: PositiveInt
+
+
+class ChunkBatchResult(BaseModel):
+    start: int = Field(description="Index of the first chunk of the batch")
+    stop: int = Field(description="Index after the last chunk of the batch")
+    success: bool
+    error: Optional[str] = None
+
+    @property
+    def number_of_chunks(self) -> int:
+        return self.stop - self.start
+
+
+class ChunkIngestionReport(BaseModel):
+    batches: List[ChunkBatchResult] = Field(default_factory=list)
+
+    @property
+    def success(self) -> bool:
+        return all(batch.success for batch in self.batches)
+
+    @property
+    def number_of_failed_chunks(self) -> int:
+        return sum(batch.number_of_chunks for batch in self.failed_batches)
+
+    @property
+    def failed_batches(self) -> List[ChunkBatchResult]:
+        return [batch for batch in self.batches if not batch.success]
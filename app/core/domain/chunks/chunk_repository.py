@@ -1,15 +1,21 @@
+import asyncio
 import os
-from typing import List, Optional
+import uuid
+from typing import AsyncIterator, List, Optional, Set, Tuple
 
 from fastapi.exceptions import RequestValidationError, HTTPException
-from langchain_core.documents import Document
-from langchain_qdrant import QdrantVectorStore
 from qdrant_client import models
-from app.core.domain.chunks.chunk_interface import ChunkInterface
+from app.core.domain.chunks.chunk_interface import ChunkInterface, AsyncChunkInterface
+from app.core.domain.retriever.hybrid_retriever import hybrid_query
+from app.core.external_services.embedding.embedding_engine import EmbeddingEngine
+from app.core.external_services.embedding.sparse_encoder import BM25SparseEncoder
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import SPARSE_VECTOR_NAME
 from app.models.dto.search import DocumentWithScore
-from app.core.domain.chunks.chunk_model import ChunkModel, ChunkMetadata
+from app.core.domain.chunks.chunk_model import ChunkLike, ChunkMetadata, ChunkBatchResult, ChunkIngestionReport, \
+    ChunkRecordMetadata, ChunkSearchQuery, SearchMode
+from app.core.domain.qa.qa_answer_cache import QAAnswerCache
 from dotenv import load_dotenv
 from app.core.utils.logger import Logger
 
@@ -20,46 +26,143 @@ logger = Logger('Logger')
 COLLECTION_NAME = os.getenv("VECTOR_STORE_COLLECTION")
 MAX_K_RESULTS = os.getenv("MAX_K_RESULTS")
 
+VECTOR_STORE_UPSERT_BATCH_SIZE = int(os.getenv("VECTOR_STORE_UPSERT_BATCH_SIZE", 256))
+VECTOR_STORE_UPSERT_PARALLELISM = int(os.getenv("VECTOR_STORE_UPSERT_PARALLELISM", 4))
+VECTOR_STORE_UPSERT_WAIT = os.getenv("VECTOR_STORE_UPSERT_WAIT", "true").lower() == "true"
+# Number of chunks per scroll page when the chunks of a user or document are listed
+DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", 100))
+
+# Namespace of the deterministic point ids of the chunks
+CHUNK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "costudy-ai/chunks")
+
+
+def chunk_point_id(metadata: ChunkMetadata | ChunkRecordMetadata) -> str:
+    """The point id is derived from the chunk position, so a retried upload overwrites its points."""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{metadata.owner_id}/{metadata.document_id}/"
+                                              f"{metadata.page_number}/{metadata.on_page_index}"))
+
+
+def metadata_payload(metadata: ChunkMetadata | ChunkRecordMetadata) -> dict:
+    return {
+        "document_id": metadata.document_id,
+        "conversation_id": metadata.conversation_id,
+        "owner_id": metadata.owner_id,
+        "page_number": metadata.page_number,
+        "on_page_index": metadata.on_page_index,
+    }
+
+
+def chunk_points(chunks: List[ChunkLike], vectors: List[List[float]],
+                 sparse_vectors: Optional[List[models.SparseVector]] = None) -> List[models.PointStruct]:
+    # Same payload layout as the langchain Qdrant vector store, which is used by the retrievers
+    if sparse_vectors is not None:
+        # The dense vector stays the unnamed default vector
+        vectors = [{"": vector, SPARSE_VECTOR_NAME: sparse_vector}
+                   for vector, sparse_vector in zip(vectors, sparse_vectors)]
+    return [
+        models.PointStruct(
+            id=chunk_point_id(chunk.metadata),
+            vector=vector,
+            payload={"page_content": chunk.content, "metadata": metadata_payload(chunk.metadata)}
+        ) for chunk, vector in zip(chunks, vectors)
+    ]
+
+
+def chunk_filter(user_id: str, document_id: Optional[str] = None) -> models.Filter:
+    conditions = [models.FieldCondition(
+        key="metadata.owner_id",
+        match=models.MatchValue(value=user_id)
+    )]
+
+    if document_id is not None:
+        conditions.append(models.FieldCondition(
+            key="metadata.document_id",
+            match=models.MatchValue(value=document_id)
+        ))
+
+    return models.Filter(must=conditions)
+
+
+def scored_point_to_document(point: models.ScoredPoint) -> DocumentWithScore:
+    # The payload was validated and cleaned before it was stored, so it is not validated again.
+    # The score is the raw Qdrant score like the langchain Qdrant store returned it: the cosine similarity in dense
+    # search and the reciprocal rank fusion score in hybrid search.
+    metadata = point.payload["metadata"]
+    return DocumentWithScore.model_construct(
+        content=point.payload["page_content"],
+        metadata=ChunkMetadata.model_construct(
+            document_id=metadata["document_id"],
+            owner_id=metadata["owner_id"],
+            page_number=metadata["page_number"],
+            on_page_index=metadata["on_page_index"],
+            conversation_id=metadata["conversation_id"]
+        ),
+        score=point.score
+    )
+
+
+def use_hybrid_search(vector_store: VectorStore, mode: SearchMode) -> bool:
+    if mode != "hybrid":
+        return False
+    if not vector_store.supports_sparse_vectors():
+        logger.log(level="warning", func_name="use_hybrid_search",
+                   message="The collection has no sparse vectors, falling back to dense search")
+        return False
+    return True
+
+
+def invalidate_answers(chunks: List[ChunkLike]):
+    """Drops the cached QA answers of the documents of the chunks, they may be outdated by the new chunks."""
+    for owner_id, document_id in {(chunk.metadata.owner_id, chunk.metadata.document_id) for chunk in chunks}:
+        QAAnswerCache().invalidate(owner_id=owner_id, document_id=document_id)
+
 
 class ChunkRepository(ChunkInterface):
 
-    def __init__(self, vector_Store: VectorStore):
+    def __init__(self, vector_Store: VectorStore,
+                 batch_size: int = VECTOR_STORE_UPSERT_BATCH_SIZE,
+                 wait: bool = VECTOR_STORE_UPSERT_WAIT,
+                 sparse_encoder: BM25SparseEncoder | None = None):
         self.vector_Store = vector_Store
         self.client = vector_Store.get_client()
+        self.batch_size = batch_size
+        self.wait = wait
+        self.sparse_encoder = sparse_encoder or BM25SparseEncoder()
 
     @logger.log_decorator(level="debug", message="Add chunks to collection")
-    def add_chunks(self, chunks: List[ChunkModel], embedding_model: EmbeddingModel) -> bool:
-        documents = [Document(page_content=chunk.content, metadata=chunk.metadata) for chunk in chunks]
+    def add_chunks(self, chunks: List[ChunkLike], embedding_model: EmbeddingModel) -> ChunkIngestionReport:
+        report = ChunkIngestionReport()
+        embeddings = embedding_model.get_model()
+        with_sparse_vectors = self.vector_Store.supports_sparse_vectors()
 
-        try:
-            QdrantVectorStore.from_documents(
-                documents=documents,
-                embedding=embedding_model.get_model(),
-                url=os.getenv("VECTOR_STORE_URL"),
-                collection_name=os.getenv("VECTOR_STORE_COLLECTION"),
-                metadata_payload_key="metadata",
-            )
-            return True
-        except:
-            return False
+        for start in range(0, len(chunks), self.batch_size):
+            batch = chunks[start:start + self.batch_size]
+            try:
+                texts = [chunk.content for chunk in batch]
+                vectors = embeddings.embed_documents(texts)
+                sparse_vectors = self.sparse_encoder.encode_documents(texts) if with_sparse_vectors else None
+                self.client.upsert(collection_name=COLLECTION_NAME, points=chunk_points(batch, vectors, sparse_vectors),
+                                   wait=self.wait)
+                report.batches.append(ChunkBatchResult(start=start, stop=start + len(batch), success=True))
+            except Exception as e:
+                logger.log(level="error", func_name="ChunkRepository.add_chunks", message=str(e))
+                report.batches.append(ChunkBatchResult(start=start, stop=start + len(batch), success=False,
+                                                       error=str(e)))
+
+        invalidate_answers(chunks)
+        return report
 
     @logger.log_decorator(level="debug", message="Get chunks to collection")
-    def get_chunks(self, user_id: str, document_id: str):  # -> List[ChunkModel]:
+    def get_chunks(self, user_id: str, document_id: str, limit: int = DOCUMENTS_PAGE_SIZE,
+                   offset: Optional[models.ExtendedPointId] = None
+                   ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        """Returns one page of chunks of the document and the offset of the next page (None on the last page)."""
         try:
             return self.client.scroll(
                 collection_name=COLLECTION_NAME,
-                scroll_filter=models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="metadata.owner_id",
-                            match=models.MatchValue(value=user_id)
-                        ),
-                        models.FieldCondition(
-                            key="metadata.document_id",
-                            match=models.MatchValue(value=document_id)
-                        )
-                    ]
-                ),
+                scroll_filter=chunk_filter(user_id, document_id),
+                limit=limit,
+                offset=offset,
                 with_payload=True,
                 with_vectors=False,
             )
@@ -69,17 +172,15 @@ class ChunkRepository(ChunkInterface):
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def get_all_chunks(self, user_id: str):
+    def get_all_chunks(self, user_id: str, limit: int = DOCUMENTS_PAGE_SIZE,
+                       offset: Optional[models.ExtendedPointId] = None
+                       ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        """Returns one page of chunks of all documents of the user and the offset of the next page."""
         return self.client.scroll(
             collection_name=COLLECTION_NAME,
-            scroll_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="metadata.owner_id",
-                        match=models.MatchValue(value=user_id)
-                    )
-                ]
-            ),
+            scroll_filter=chunk_filter(user_id),
+            limit=limit,
+            offset=offset,
             with_payload=True,
             with_vectors=False,
         )
@@ -98,7 +199,7 @@ class ChunkRepository(ChunkInterface):
             ))
 
         try:
-            return self.client.delete(
+            result = self.client.delete(
                 collection_name=COLLECTION_NAME,
                 points_selector=models.FilterSelector(
                     filter=models.Filter(
@@ -112,40 +213,260 @@ class ChunkRepository(ChunkInterface):
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+        # Cached answers may cite the deleted chunks
+        QAAnswerCache().invalidate(owner_id=user_id, document_id=document_id)
+        return result
+
     @logger.log_decorator(level="debug", message="Search for chunks")
     def search_chunks(self, embedding_model: EmbeddingModel, query: str, user_id: str,
                       document_id: Optional[str] = None,
-                      k: int = MAX_K_RESULTS):
+                      k: int = MAX_K_RESULTS,
+                      mode: SearchMode = "dense") -> List[DocumentWithScore]:
         try:
-            connection = self.vector_Store.get_connection(embedding_model)
+            query_vector = embedding_model.get_model().embed_query(query)
+            if use_hybrid_search(self.vector_Store, mode):
+                response = self.client.query_points(
+                    collection_name=COLLECTION_NAME,
+                    with_payload=True,
+                    **hybrid_query(query_vector, self.sparse_encoder.encode_query(query),
+                                   query_filter=chunk_filter(user_id, document_id),
+                                   limit=int(k),
+                                   search_params=self.vector_Store.get_search_params())
+                )
+                return [scored_point_to_document(point) for point in response.points]
 
-            if document_id is None:
-                filter = {"owner_id": user_id}
-            else:
-                filter = {"owner_id": user_id, "document_id": document_id}
+            response = self.client.query_points(
+                collection_name=COLLECTION_NAME,
+                query=query_vector,
+                query_filter=chunk_filter(user_id, document_id),
+                limit=int(k),
+                search_params=self.vector_Store.get_search_params(),
+                with_payload=True,
+            )
+            return [scored_point_to_document(point) for point in response.points]
+
+        except RequestValidationError:
+            raise HTTPException(status_code=400, detail="Invalid input")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+class AsyncChunkRepository(AsyncChunkInterface):
+    """Non-blocking variant of the ChunkRepository backed by the AsyncQdrantClient of the shared vector store."""
+
+    def __init__(self, vector_Store: VectorStore,
+                 batch_size: int = VECTOR_STORE_UPSERT_BATCH_SIZE,
+                 parallelism: int = VECTOR_STORE_UPSERT_PARALLELISM,
+                 wait: bool = VECTOR_STORE_UPSERT_WAIT,
+                 sparse_encoder: BM25SparseEncoder | None = None):
+        self.vector_Store = vector_Store
+        self.client = vector_Store.get_async_client()
+        self.batch_size = batch_size
+        self.parallelism = parallelism
+        self.wait = wait
+        self.sparse_encoder = sparse_encoder or BM25SparseEncoder()
+
+    @logger.log_decorator(level="debug", message="Add chunks to collection")
+    async def add_chunks(self, chunks: List[ChunkLike], embedding_model: EmbeddingModel) -> ChunkIngestionReport:
+        report = ChunkIngestionReport()
+        engine = EmbeddingEngine(embedding_model)
+        semaphore = asyncio.Semaphore(self.parallelism)
+        with_sparse_vectors = self.vector_Store.supports_sparse_vectors()
+        upserts = []
 
-            results = connection.similarity_search_with_relevance_scores(
-                query=query,
-                k=k,
-                filter=filter,
+        async def upsert(start: int, stop: int, vectors: List[List[float]]) -> ChunkBatchResult:
+            async with semaphore:
+                try:
+                    # The BM25 encoding is CPU bound and must not block the event loop
+                    points = await asyncio.to_thread(self._points, chunks[start:stop], vectors, with_sparse_vectors)
+                    await self.client.upsert(collection_name=COLLECTION_NAME, points=points, wait=self.wait)
+                    return ChunkBatchResult(start=start, stop=stop, success=True)
+                except Exception as e:
+                    logger.log(level="error", func_name="AsyncChunkRepository.add_chunks", message=str(e))
+                    return ChunkBatchResult(start=start, stop=stop, success=False, error=str(e))
+
+        # Every embedded batch is upserted as soon as its vectors arrive
+        async for start, stop, vectors in engine.embed_batches([chunk.content for chunk in chunks],
+                                                               return_exceptions=True):
+            if isinstance(vectors, Exception):
+                logger.log(level="error", func_name="AsyncChunkRepository.add_chunks", message=str(vectors))
+                report.batches.append(ChunkBatchResult(start=start, stop=stop, success=False, error=str(vectors)))
+                continue
+
+            for batch_start in range(start, stop, self.batch_size):
+                batch_stop = min(batch_start + self.batch_size, stop)
+                upserts.append(asyncio.create_task(
+                    upsert(batch_start, batch_stop, vectors[batch_start - start:batch_stop - start])
+                ))
+
+        report.batches.extend(await asyncio.gather(*upserts))
+        report.batches.sort(key=lambda batch: batch.start)
+        invalidate_answers(chunks)
+        return report
+
+    def _points(self, batch: List[ChunkLike], vectors: List[List[float]],
+                with_sparse_vectors: bool) -> List[models.PointStruct]:
+        sparse_vectors = (self.sparse_encoder.encode_documents([chunk.content for chunk in batch])
+                          if with_sparse_vectors else None)
+        return chunk_points(batch, vectors, sparse_vectors)
+
+    @logger.log_decorator(level="debug", message="Get chunks to collection")
+    async def get_chunks(self, user_id: str, document_id: str, limit: int = DOCUMENTS_PAGE_SIZE,
+                         offset: Optional[models.ExtendedPointId] = None
+                         ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        """Returns one page of chunks of the document and the offset of the next page (None on the last page)."""
+        try:
+            return await self.client.scroll(
+                collection_name=COLLECTION_NAME,
+                scroll_filter=chunk_filter(user_id, document_id),
+                limit=limit,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
             )
 
-            for result in results:
-                document_data, score = result
-                yield DocumentWithScore(
-                    content=document_data.page_content,
-                    metadata=ChunkMetadata(
-                        document_id=document_data.metadata["document_id"],
-                        owner_id=document_data.metadata["owner_id"],
-                        page_number=document_data.metadata["page_number"],
-                        on_page_index=document_data.metadata["on_page_index"],
-                        conversation_id=document_data.metadata["conversation_id"]
-                    ),
-                    score=score
+        except RequestValidationError:
+            raise HTTPException(status_code=400, detail="Invalid input")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_all_chunks(self, user_id: str, limit: int = DOCUMENTS_PAGE_SIZE,
+                             offset: Optional[models.ExtendedPointId] = None
+                             ) -> Tuple[List[models.Record], Optional[models.ExtendedPointId]]:
+        """Returns one page of chunks of all documents of the user and the offset of the next page."""
+        return await self.client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=chunk_filter(user_id),
+            limit=limit,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+
+    async def iter_chunks(self, user_id: str, document_id: Optional[str] = None,
+                          page_size: int = DOCUMENTS_PAGE_SIZE) -> AsyncIterator[List[models.Record]]:
+        """
+        Yields the chunks of a user, or of one of their documents, page by page. The next page is only requested
+        once the consumer asks for it, so at most one page is held in memory.
+        """
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name=COLLECTION_NAME,
+                scroll_filter=chunk_filter(user_id, document_id),
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            if records:
+                yield records
+            if offset is None:
+                return
+
+    @logger.log_decorator(level="debug", message="Delete chunks from one doucment from the collection")
+    async def delete_chunks(self, user_id: str, document_id: Optional[str] = None):
+        """Deletes the chunks of one document of the user, or of all their documents without a document_id."""
+        try:
+            result = await self.client.delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=models.FilterSelector(filter=chunk_filter(user_id, document_id)),
+            )
+        except RequestValidationError:
+            raise HTTPException(status_code=400, detail="Invalid input")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # Cached answers may cite the deleted chunks
+        QAAnswerCache().invalidate(owner_id=user_id, document_id=document_id)
+        return result
+
+    @logger.log_decorator(level="debug", message="Delete stale chunks of a document from the collection")
+    async def delete_stale_chunks(self, user_id: str, document_id: str, keep_ids: Set[str]):
+        """Deletes the chunks of the document except the points in keep_ids, the chunks of its latest upload."""
+        chunks_filter = chunk_filter(user_id, document_id)
+        chunks_filter.must_not = [models.HasIdCondition(has_id=list(keep_ids))]
+        try:
+            result = await self.client.delete(collection_name=COLLECTION_NAME,
+                                              points_selector=models.FilterSelector(filter=chunks_filter))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        QAAnswerCache().invalidate(owner_id=user_id, document_id=document_id)
+        return result
+
+    @logger.log_decorator(level="debug", message="Delete chunks by id from the collection")
+    async def delete_chunk_ids(self, user_id: str, document_id: str, point_ids: Set[str]):
+        """Deletes the given points of the document, e.g. the chunks written by a failed upload."""
+        try:
+            result = await self.client.delete(collection_name=COLLECTION_NAME,
+                                              points_selector=models.PointIdsList(points=list(point_ids)))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        QAAnswerCache().invalidate(owner_id=user_id, document_id=document_id)
+        return result
+
+    @logger.log_decorator(level="debug", message="Search for chunks")
+    async def search_chunks(self, embedding_model: EmbeddingModel, query: str, user_id: str,
+                            document_id: Optional[str] = None,
+                            k: int = MAX_K_RESULTS,
+                            mode: SearchMode = "dense") -> List[DocumentWithScore]:
+        try:
+            query_vector = await embedding_model.get_model().aembed_query(query)
+            if use_hybrid_search(self.vector_Store, mode):
+                response = await self.client.query_points(
+                    collection_name=COLLECTION_NAME,
+                    with_payload=True,
+                    **hybrid_query(query_vector, self.sparse_encoder.encode_query(query),
+                                   query_filter=chunk_filter(user_id, document_id),
+                                   limit=int(k),
+                                   search_params=self.vector_Store.get_search_params())
                 )
+                return [scored_point_to_document(point) for point in response.points]
+
+            response = await self.client.query_points(
+                collection_name=COLLECTION_NAME,
+                query=query_vector,
+                query_filter=chunk_filter(user_id, document_id),
+                limit=int(k),
+                search_params=self.vector_Store.get_search_params(),
+                with_payload=True,
+            )
+            return [scored_point_to_document(point) for point in response.points]
+
+        except RequestValidationError:
+            raise HTTPException(status_code=400, detail="Invalid input")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @logger.log_decorator(level="debug", message="Search for chunks in batch")
+    async def search_chunks_batch(self, embedding_model: EmbeddingModel,
+                                  queries: List[ChunkSearchQuery]) -> List[List[DocumentWithScore]]:
+        """
+        Embeds all queries together and runs them as one batch query in Qdrant. Returns the results of every query
+        in the order of the queries.
+        """
+        try:
+            vectors = await EmbeddingEngine(embedding_model).embed([query.query for query in queries])
+            search_params = self.vector_Store.get_search_params()
+
+            responses = await self.client.query_batch_points(
+                collection_name=COLLECTION_NAME,
+                requests=[
+                    models.QueryRequest(
+                        query=vector,
+                        filter=chunk_filter(query.user_id, query.document_id),
+                        limit=query.k,
+                        params=search_params,
+                        with_payload=True,
+                    ) for query, vector in zip(queries, vectors)
+                ],
+            )
+
+            return [[scored_point_to_document(point) for point in response.points] for response in responses]
 
         except RequestValidationError:
             raise HTTPException(status_code=400, detail="Invalid input")
         except Exception as e:
-            print(e)
             raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.domain.qa.qa_models import QALLMResponse
+from app.core.utils.logger import Logger
+from app.core.utils.singleton import SingletonMeta
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+QA_ANSWER_CACHE_ENABLED = os.getenv("QA_ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between the query embeddings of a cached and a new question
+QA_ANSWER_CACHE_THRESHOLD = float(os.getenv("QA_ANSWER_CACHE_THRESHOLD", 0.95))
+QA_ANSWER_CACHE_TTL = float(os.getenv("QA_ANSWER_CACHE_TTL", 3600))
+QA_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("QA_ANSWER_CACHE_MAX_ENTRIES", 2048))
+
+# (owner_id, document_id, conversation_id), the same scope the retriever filters on
+AnswerScope = Tuple[str, Optional[str], Optional[str]]
+
+
+def answer_variant(**options: Any) -> str:
+    """
+    Hash of everything besides the scope and the question that changes the answer: the chat history, the retrieval
+    options and the llm settings. Answers are only reused for the same variant.
+    """
+    return hashlib.sha256(repr(sorted(options.items())).encode()).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("scope", "variant", "vector", "response", "expires_at")
+
+    def __init__(self, scope: AnswerScope, variant: str, vector: np.ndarray, response: QALLMResponse,
+                 expires_at: float):
+        self.scope = scope
+        self.variant = variant
+        self.vector = vector
+        self.response = response
+        self.expires_at = expires_at
+
+
+class QAAnswerCache(metaclass=SingletonMeta):
+    """
+    Process-wide semantic cache of QA answers. A question hits the cache if a question of the same scope and
+    variant (see answer_variant) with a query embedding above the similarity threshold was answered before and the
+    answer has not expired. Entries are evicted by TTL and least recent use, and all entries of a document are
+    dropped when its chunks change. The cache and its invalidation are local to the process: with several workers,
+    another worker keeps answering from its own entries until they expire, so keep the TTL short in that setup.
+    """
+
+    def __init__(self,
+                 threshold: float = QA_ANSWER_CACHE_THRESHOLD,
+                 ttl: float = QA_ANSWER_CACHE_TTL,
+                 max_entries: int = QA_ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._keys: Dict[Tuple[AnswerScope, str], Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: AnswerScope, vector: List[float], variant: str = "") -> Optional[QALLMResponse]:
+        query = _normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            entry_ids = [entry_id for entry_id in list(self._keys.get((scope, variant), ()))
+                         if self._alive(entry_id, now)]
+            if entry_ids:
+                similarities = np.stack([self._entries[entry_id].vector for entry_id in entry_ids]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(entry_ids[best])
+                    self.hits += 1
+                    return self._entries[entry_ids[best]].response.model_copy(deep=True)
+
+            self.misses += 1
+            return None
+
+    def put(self, scope: AnswerScope, vector: List[float], response: QALLMResponse, variant: str = ""):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(scope, variant, _normalize(vector), response.model_copy(deep=True),
+                                             time.monotonic() + self.ttl)
+            self._keys.setdefault((scope, variant), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, owner_id: str, document_id: Optional[str] = None) -> int:
+        """
+        Drops the answers that may be based on chunks of the document, or on any chunk of the owner if no document
+        is given. Answers across all documents of the owner are always dropped. Returns the number of dropped answers.
+        Only the cache of this process is invalidated.
+        """
+        with self._lock:
+            keys = [key for key in self._keys
+                    if key[0][0] == owner_id and (document_id is None or key[0][1] in (document_id, None))]
+            entry_ids = [entry_id for key in keys for entry_id in self._keys[key]]
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+
+        if entry_ids:
+            logger.log(level="debug", func_name="QAAnswerCache.invalidate",
+                       message=f"Dropped {len(entry_ids)} cached answers of document {document_id}")
+        return len(entry_ids)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _alive(self, entry_id: int, now: float) -> bool:
+        if self._entries[entry_id].expires_at > now:
+            return True
+        self._remove(entry_id)
+        return False
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        key = (entry.scope, entry.variant)
+        key_ids = self._keys[key]
+        key_ids.discard(entry_id)
+        if not key_ids:
+            del self._keys[key]
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,130 @@
+import copy
+import os
+import threading
+from typing import Dict, Literal, Optional
+
+from dotenv import load_dotenv
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from app.core.domain.qa.qa_chain_interface import QAChains
+from app.core.domain.qa.qa_chain_service import QAChainService
+from app.core.domain.qa.qa_prompts_interface import QAPromptsInterface
+from app.core.domain.retriever.reranker import CrossEncoderReranker, RerankingRetriever, RERANKER_CANDIDATES, \
+    reranker_available
+from app.core.domain.retriever.retriever import Retriever
+from app.core.external_services.llm.llm_port import LlmModel
+from app.core.utils.logger import Logger
+from app.core.utils.singleton import SingletonMeta
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+MAX_K_RESULTS = int(os.getenv("MAX_K_RESULTS"))
+# Cheaper or faster model for rewriting questions from the chat history. Defaults to the model of the request.
+QA_CONDENSE_MODEL = os.getenv("QA_CONDENSE_MODEL")
+
+RetrieverType = Literal["mmr", "similarity", "hybrid"]
+
+
+def qa_chain_config(llm: LlmModel,
+                    retriever: Retriever,
+                    user_id: str,
+                    document_id: Optional[str] = None,
+                    conversation_id: Optional[str] = None,
+                    k: int = MAX_K_RESULTS,
+                    fetch_k: Optional[int] = None,
+                    lambda_mult: Optional[float] = None,
+                    rerank: Optional[bool] = None) -> RunnableConfig:
+    """Runtime config of a cached rag chain. It carries everything that belongs to a single request."""
+    return {
+        "configurable": {
+            "llm": llm,
+            "retriever": retriever,
+            "user_id": user_id,
+            "document_id": document_id,
+            "conversation_id": conversation_id,
+            "k": k,
+            # MMR settings, the defaults of the retriever are used if they are not set
+            "fetch_k": fetch_k,
+            "lambda_mult": lambda_mult,
+            # Reranks RERANKER_CANDIDATES retrieved chunks down to k, on by default if a reranker is available
+            "rerank": reranker_available() if rerank is None else rerank and reranker_available(),
+        }
+    }
+
+
+def _configured_llm(model_name: Optional[str] = None) -> Runnable:
+    # The returned chat model is invoked (or streamed) with the input of the lambda
+    def select_llm(_input, config: RunnableConfig) -> Runnable:
+        llm: LlmModel = config["configurable"]["llm"]
+        if model_name:
+            # Same api key and settings, only the model is replaced
+            llm = copy.copy(llm)
+            llm.set_model(model_name)
+        return llm.get_llm()
+
+    async def aselect_llm(_input, config: RunnableConfig) -> Runnable:
+        return select_llm(_input, config)
+
+    return RunnableLambda(select_llm, afunc=aselect_llm, name=f"configured_llm_{model_name or 'default'}")
+
+
+def _configured_retriever(retriever_type: RetrieverType) -> Runnable:
+    def select_retriever(_query: str, config: RunnableConfig) -> Runnable:
+        configurable = config["configurable"]
+        retriever: Retriever = configurable["retriever"]
+        filters = {"user_id": configurable["user_id"],
+                   "document_id": configurable["document_id"],
+                   "conversation_id": configurable["conversation_id"],
+                   "k": configurable["k"]}
+        rerank = configurable.get("rerank", False)
+        if rerank:
+            # Over-fetch, the reranker keeps the best k candidates
+            filters["k"] = max(configurable["k"], RERANKER_CANDIDATES)
+
+        if retriever_type == "mmr":
+            mmr_settings = {key: configurable[key] for key in ("fetch_k", "lambda_mult")
+                            if configurable.get(key) is not None}
+            selected = retriever.get_mmr_retriever(**filters, **mmr_settings)
+        elif retriever_type == "hybrid":
+            selected = retriever.get_hybrid_retriever(**filters)
+        else:
+            selected = retriever.get_similarity_retriever(**filters)
+
+        if rerank:
+            return RerankingRetriever(retriever=selected, reranker=CrossEncoderReranker(), top_n=configurable["k"])
+        return selected
+
+    async def aselect_retriever(_query: str, config: RunnableConfig) -> Runnable:
+        return select_retriever(_query, config)
+
+    return RunnableLambda(select_retriever, afunc=aselect_retriever, name=f"configured_{retriever_type}_retriever")
+
+
+class QAChainFactory(metaclass=SingletonMeta):
+    """
+    Builds the rag chain once per prompt set and retriever type. The llm, the retriever and the filters of a request
+    are not part of the chain, they are passed in the runtime config (see qa_chain_config).
+    """
+
+    def __init__(self, chains: QAChains | None = None):
+        self.chains = chains or QAChainService()
+        self._rag_chains: Dict[tuple, Runnable] = {}
+        self._lock = threading.Lock()
+
+    def get_rag_chain(self, prompts: QAPromptsInterface, retriever_type: RetrieverType = "mmr") -> Runnable:
+        key = (prompts.get_prompt_set_key(), retriever_type)
+        with self._lock:
+            if key not in self._rag_chains:
+                logger.log(level="debug", func_name="QAChainFactory.get_rag_chain",
+                           message=f"Building rag chain for the {retriever_type} retriever")
+                self._rag_chains[key] = self._build_rag_chain(prompts, retriever_type)
+            return self._rag_chains[key]
+
+    def _build_rag_chain(self, prompts: QAPromptsInterface, retriever_type: RetrieverType) -> Runnable:
+        retriever_chain = self.chains.get_vector_store_retriever_chain(llm=_configured_llm(QA_CONDENSE_MODEL),
+                                                                       retriever=_configured_retriever(retriever_type),
+                                                                       prompt=prompts)
+        llm_chain = self.chains.get_llm_chain(llm=_configured_llm(), prompt=prompts)
+        return self.chains.get_qa_chain(retriever_chain=retriever_chain, llm_chain=llm_chain)
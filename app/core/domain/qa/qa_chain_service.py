@@ -1,18 +1,18 @@
-import os
-from typing import Optional
+from contextlib import aclosing
+from typing import AsyncIterator, List, Union
 
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.history_aware_retriever import create_history_aware_retriever
 from langchain.chains.retrieval import create_retrieval_chain
-from langchain_core.runnables import Runnable
-from pydantic import PositiveInt
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
 
 from app.core.domain.qa.qa_chain_interface import QAChains
+from app.core.domain.qa.qa_condense_service import QuestionCondenser
+from app.core.domain.qa.qa_context_packer import ContextPacker, QA_CONTEXT_PACKING_ENABLED
+from app.core.domain.qa.qa_history_manager import ChatHistoryManager, QA_HISTORY_WINDOW_ENABLED
 from app.core.domain.qa.qa_models import QALLMResponse
 from app.core.domain.qa.qa_prompts_interface import QAPromptsInterface
-from app.core.external_services.llm.llm_port import LlmModel
-
-from app.core.domain.retriever.retriever import Retriever
 from app.models.objects.chat_history_model import ChatHistory
 from app.core.domain.chunks.chunk_model import ChunkModel, ChunkMetadata
 from dotenv import load_dotenv
@@ -23,31 +23,33 @@ load_dotenv()
 
 logger = Logger('Logger')
 
+NO_DOCUMENTS_ANSWER = ("I am sorry, but I could not find any related documents to your question."
+                       "/nPlease try again with a different question.")
+
 
 class QAChainService(QAChains):
-    def __init__(self):
-        pass
+    def __init__(self, context_packer: ContextPacker | None = None, history_manager: ChatHistoryManager | None = None):
+        # Fits the retrieved chunks into the input token budget, see ContextPacker
+        self.context_packer = context_packer or (ContextPacker() if QA_CONTEXT_PACKING_ENABLED else None)
+        # Recent messages and a summary of the older ones instead of the full history, see ChatHistoryManager
+        self.history_manager = history_manager or (ChatHistoryManager() if QA_HISTORY_WINDOW_ENABLED else None)
 
     @logger.log_decorator(level="debug", message="Step 1: Creating vector store retriever chain")
     def get_vector_store_retriever_chain(self,
-                                         user_id: str,
-                                         llm: LlmModel,
-                                         retriever: Retriever,
+                                         llm: Runnable,
+                                         retriever: Runnable,
                                          prompt: QAPromptsInterface,
-                                         document_id: Optional[str] = None,
-                                         conversation_id: Optional[str] = None,
-                                         k: PositiveInt = int(os.getenv("MAX_K_RESULTS"))
                                          ) -> Runnable:
-        return create_history_aware_retriever(
-            llm=llm.get_llm(),
-            retriever=retriever.get_mmr_retriever(user_id=user_id, document_id=document_id,
-                                                  conversation_id=conversation_id, k=k),
-            prompt=prompt.get_history_aware_prompt_for_vector_store_retriever()
-        )
+        # Rewrites the question from the chat history only when needed, see QuestionCondenser
+        condenser = QuestionCondenser(llm=llm, prompt=prompt.get_history_aware_prompt_for_vector_store_retriever())
+        chain = condenser.as_runnable() | retriever
+        if self.context_packer is not None:
+            chain = chain | self.context_packer.as_runnable()
+        return chain.with_config(run_name="chat_retriever_chain")
 
     @logger.log_decorator(level="debug", message="Step 2: Creating llm chain")
-    def get_llm_chain(self, llm, prompt):
-        return create_stuff_documents_chain(llm=llm.get_llm(),
+    def get_llm_chain(self, llm: Runnable, prompt: QAPromptsInterface) -> Runnable:
+        return create_stuff_documents_chain(llm=llm,
                                             prompt=prompt.get_llm_prompt_with_context())
 
     @logger.log_decorator(level="debug", message="Step 3: Creating rag chain")
@@ -58,16 +60,54 @@ class QAChainService(QAChains):
         )
 
     @logger.log_decorator(level="debug", message="Step 4: Running rag chain")
-    def run_qa_chain(self, rag_chain, query, chat_history: ChatHistory, user_id) -> QALLMResponse:
-        chat_history = chat_history.get_langchain_base_chat_message_history().messages
+    async def run_qa_chain(self, rag_chain, query, chat_history: ChatHistory, config: RunnableConfig) -> QALLMResponse:
+        chat_history = await self._history_messages(chat_history, config)
 
-        response = rag_chain.invoke(
-            {"input": query, "chat_history": chat_history}
+        response = await rag_chain.ainvoke(
+            {"input": query, "chat_history": chat_history},
+            config=config,
         )
 
+        return self._to_llm_response(query=query, answer=response["answer"], context=response["context"])
+
+    @logger.log_decorator(level="debug", message="Step 4: Streaming rag chain")
+    async def stream_qa_chain(self, rag_chain, query, chat_history: ChatHistory,
+                              config: RunnableConfig) -> AsyncIterator[Union[str, QALLMResponse]]:
+        """
+        Yields the answer tokens as the llm generates them and finally the complete response with the related
+        documents.
+        """
+        chat_history = await self._history_messages(chat_history, config)
+        answer: List[str] = []
+        context: List[Document] = []
+
+        # aclosing finalizes the pending steps of the chain when the loop is left early, not the garbage collector
+        async with aclosing(rag_chain.astream({"input": query, "chat_history": chat_history},
+                                              config=config)) as stream:
+            async for chunk in stream:
+                if "context" in chunk:
+                    context = chunk["context"]
+                    # The documents are retrieved before the llm is called, so it can be skipped without context
+                    if len(context) == 0:
+                        break
+                if chunk.get("answer"):
+                    answer.append(chunk["answer"])
+                    yield chunk["answer"]
+
+        llm_response = self._to_llm_response(query=query, answer="".join(answer), context=context)
+        if len(context) == 0:
+            yield llm_response.answer
+        yield llm_response
+
+    async def _history_messages(self, chat_history: ChatHistory, config: RunnableConfig) -> List[BaseMessage]:
+        if self.history_manager is None:
+            return chat_history.to_langchain_messages()
+        return await self.history_manager.aprepare(chat_history, config)
+
+    def _to_llm_response(self, query: str, answer: str, context: List[Document]) -> QALLMResponse:
         llm_response: QALLMResponse = QALLMResponse(
             question=query,
-            answer=response["answer"],
+            answer=answer,
             related_documents=[
                 ChunkModel(
                     content=doc.page_content,
@@ -78,7 +118,7 @@ class QAChainService(QAChains):
                         on_page_index=doc.metadata["on_page_index"],
                         conversation_id=doc.metadata["conversation_id"]
                     )
-                ) for doc in response["context"]
+                ) for doc in context
             ]
         )
 
@@ -90,8 +130,7 @@ class QAChainService(QAChains):
             logger.log(level="warning", func_name="RagChainService.run_qa_chain",
                        message="No related documents found in the response")
 
-            llm_response.answer = (f"I am sorry, but I could not find any related documents to your question."
-                                   "/nPlease try again with a different question.")
+            llm_response.answer = NO_DOCUMENTS_ANSWER
 
         logger.log(level="debug", func_name="RagChainService.run_qa_chain",
                    message=f"Executed RAG chain. \nDocuments: {len(llm_response.related_documents)} "
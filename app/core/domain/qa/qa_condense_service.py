@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+# Histories with less content than this are not worth a rewrite, e.g. a greeting
+QA_CONDENSE_MIN_HISTORY_CHARS = int(os.getenv("QA_CONDENSE_MIN_HISTORY_CHARS", 20))
+QA_CONDENSE_CACHE_SIZE = int(os.getenv("QA_CONDENSE_CACHE_SIZE", 1024))
+
+CONDENSE_PATHS = ("skipped_empty", "skipped_short", "cache_hit", "rewritten")
+
+
+class CondenseMetrics:
+    """Counts how often each condensation path is taken and how long it takes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = {path: 0 for path in CONDENSE_PATHS}
+        self._seconds: Dict[str, float] = {path: 0.0 for path in CONDENSE_PATHS}
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            self._calls[path] += 1
+            self._seconds[path] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self._calls.values())
+            return {
+                path: {
+                    "calls": self._calls[path],
+                    "ratio": self._calls[path] / total if total else 0.0,
+                    "avg_ms": 1000 * self._seconds[path] / self._calls[path] if self._calls[path] else 0.0,
+                } for path in CONDENSE_PATHS
+            }
+
+
+condense_metrics = CondenseMetrics()
+
+
+def history_key(chat_history: List[BaseMessage], question: str) -> str:
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"{message.type}\x00{message.content}\x01".encode())
+    digest.update(question.encode())
+    return digest.hexdigest()
+
+
+class QuestionCondenser:
+    """
+    Rewrites the latest question into a standalone question for the retriever. The llm call is skipped when the
+    history is empty or too short to be referenced, and rewrites are cached by history and question.
+    """
+
+    def __init__(self,
+                 llm: Runnable,
+                 prompt: ChatPromptTemplate,
+                 min_history_chars: int = QA_CONDENSE_MIN_HISTORY_CHARS,
+                 cache_size: int = QA_CONDENSE_CACHE_SIZE,
+                 metrics: CondenseMetrics = condense_metrics):
+        self.rewrite_chain = prompt | llm | StrOutputParser()
+        self.min_history_chars = min_history_chars
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def as_runnable(self) -> Runnable:
+        """Runnable from the chain input ({"input", "chat_history"}) to the standalone question."""
+        return RunnableLambda(self.condense, afunc=self.acondense, name="condense_question")
+
+    def condense(self, inputs: dict, config: RunnableConfig) -> str:
+        started_at = time.perf_counter()
+        question, chat_history = inputs["input"], inputs.get("chat_history") or []
+
+        path, standalone_question = self._shortcut(question, chat_history)
+        if standalone_question is None:
+            standalone_question = self.rewrite_chain.invoke(inputs, config)
+            self._remember(history_key(chat_history, question), standalone_question)
+
+        self._record(path, started_at)
+        return standalone_question
+
+    async def acondense(self, inputs: dict, config: RunnableConfig) -> str:
+        started_at = time.perf_counter()
+        question, chat_history = inputs["input"], inputs.get("chat_history") or []
+
+        path, standalone_question = self._shortcut(question, chat_history)
+        if standalone_question is None:
+            standalone_question = await self.rewrite_chain.ainvoke(inputs, config)
+            self._remember(history_key(chat_history, question), standalone_question)
+
+        self._record(path, started_at)
+        return standalone_question
+
+    def _shortcut(self, question: str, chat_history: List[BaseMessage]) -> tuple[str, str | None]:
+        """Returns the path and the standalone question, which is None if the llm has to rewrite the question."""
+        if not chat_history:
+            return "skipped_empty", question
+        if sum(len(message.content) for message in chat_history) < self.min_history_chars:
+            return "skipped_short", question
+
+        key = history_key(chat_history, question)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return "cache_hit", self._cache[key]
+        return "rewritten", None
+
+    def _remember(self, key: str, standalone_question: str):
+        with self._lock:
+            self._cache[key] = standalone_question
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _record(self, path: str, started_at: float):
+        self.metrics.record(path, time.perf_counter() - started_at)
+        logger.log(level="debug", func_name="QuestionCondenser",
+                   message=f"Question condensation path: {path}. Stats: {self.metrics.stats()}")
@@ -0,0 +1,192 @@
+import os
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+
+import tiktoken
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from app.core.domain.chunks.chunk_model import CONTENT_MAX_LENGTH
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+QA_CONTEXT_PACKING_ENABLED = os.getenv("QA_CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+# Input tokens of the retrieved context in the llm prompt, without the question, history and instructions
+QA_CONTEXT_TOKEN_BUDGET = int(os.getenv("QA_CONTEXT_TOKEN_BUDGET", 3000))
+# Word trigram overlap (Jaccard) above which a chunk counts as a duplicate of a better one
+QA_CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("QA_CONTEXT_DUPLICATE_THRESHOLD", 0.85))
+
+WORD_PATTERN = re.compile(r"\w+")
+# Metadata keys of the relevance scores, in order of preference
+SCORE_KEYS = ("rerank_score", "_score")
+# Shortest text shared by the end of a chunk and the start of the next one that counts as the splitter overlap
+MIN_OVERLAP_LENGTH = 20
+
+
+@lru_cache(maxsize=1)
+def default_tokenizer():
+    # Same encoding as the embedding model
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def remove_overlap(previous: str, text: str, min_length: int = MIN_OVERLAP_LENGTH) -> str:
+    """
+    Returns text without the longest prefix that the previous chunk ends with, the overlap the text splitter
+    repeats in consecutive chunks. Overlaps shorter than min_length are kept, they are likely a coincidence.
+    """
+    probe = text[:min_length]
+    if len(probe) < min_length:
+        return text
+    position = previous.find(probe, max(0, len(previous) - len(text)))
+    while position != -1:
+        if text.startswith(previous[position:]):
+            return text[len(previous) - position:].lstrip()
+        position = previous.find(probe, position + 1)
+    return text
+
+
+class _Candidate:
+    __slots__ = ("document", "rank", "score", "tokens", "shingles")
+
+    def __init__(self, document: Document, rank: int, score: Optional[float]):
+        self.document = document
+        self.rank = rank
+        self.score = score
+        self.tokens = 0
+        self.shingles = frozenset()
+
+
+class ContextPacker:
+    """
+    Selects the retrieved chunks that go into the llm prompt. Chunks are taken by relevance until the token budget
+    is used up, chunks that mostly repeat a better chunk are dropped, and consecutive chunks of the same page are
+    merged into one document, without the overlap the splitter repeats and at most CONTENT_MAX_LENGTH characters
+    long, so the merged documents are still valid chunks of the response. The relevance is the rerank or search
+    score in the metadata if the retriever set one, otherwise the retrieval order. Each packed document carries its
+    score in the metadata (_score).
+    """
+
+    def __init__(self,
+                 token_budget: int = QA_CONTEXT_TOKEN_BUDGET,
+                 duplicate_threshold: float = QA_CONTEXT_DUPLICATE_THRESHOLD,
+                 tokenizer=None):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = default_tokenizer()
+        return self._tokenizer
+
+    def as_runnable(self) -> Runnable:
+        return RunnableLambda(self.pack, name="context_packer")
+
+    def pack(self, documents: List[Document]) -> List[Document]:
+        if not documents:
+            return documents
+
+        candidates = self._rank(documents)
+        selected: List[_Candidate] = []
+        used_tokens = 0
+        duplicates = over_budget = 0
+        for candidate in candidates:
+            candidate.shingles = shingles(candidate.document.page_content)
+            if any(jaccard(candidate.shingles, kept.shingles) >= self.duplicate_threshold for kept in selected):
+                duplicates += 1
+                continue
+            candidate.tokens = len(self.tokenizer.encode(candidate.document.page_content))
+            if used_tokens + candidate.tokens > self.token_budget:
+                # A smaller chunk further down may still fit
+                over_budget += 1
+                continue
+            selected.append(candidate)
+            used_tokens += candidate.tokens
+
+        if not selected:
+            # Even the best chunk exceeds the budget, it is cut instead of answering without context
+            best = candidates[0]
+            best.document = self._truncate(best.document)
+            best.tokens = self.token_budget
+            selected = [best]
+            used_tokens = best.tokens
+
+        packed = self._merge_adjacent(selected)
+        logger.log(level="debug", func_name="ContextPacker.pack",
+                   message=f"Packed {len(documents)} chunks into {len(packed)} documents with {used_tokens} tokens. "
+                           f"Dropped {duplicates} duplicates and {over_budget} chunks over the budget")
+        return packed
+
+    def _rank(self, documents: List[Document]) -> List[_Candidate]:
+        score_key = next((key for key in SCORE_KEYS if all(key in document.metadata for document in documents)),
+                         None)
+        candidates = [_Candidate(document, rank, document.metadata[score_key] if score_key else None)
+                      for rank, document in enumerate(documents)]
+        if score_key:
+            candidates.sort(key=lambda candidate: (-candidate.score, candidate.rank))
+        return candidates
+
+    def _truncate(self, document: Document) -> Document:
+        tokens = self.tokenizer.encode(document.page_content)[:self.token_budget]
+        return Document(page_content=self.tokenizer.decode(tokens), metadata=dict(document.metadata))
+
+    def _merge_adjacent(self, selected: List[_Candidate]) -> List[Document]:
+        """Merges chunks that follow each other on the same page, the merged document keeps the best rank."""
+        def page(candidate: _Candidate):
+            metadata = candidate.document.metadata
+            return metadata.get("document_id"), metadata.get("page_number")
+
+        def position(candidate: _Candidate):
+            return candidate.document.metadata.get("on_page_index")
+
+        groups: List[List[_Candidate]] = []
+        contents: List[str] = []
+        for candidate in sorted(selected, key=lambda candidate: (str(page(candidate)), position(candidate) or 0)):
+            content = candidate.document.page_content
+            previous = groups[-1][-1] if groups else None
+            if (previous is not None and page(previous) == page(candidate)
+                    and position(candidate) is not None and position(previous) is not None
+                    and position(candidate) == position(previous) + 1):
+                content = remove_overlap(previous.document.page_content, content)
+                if len(contents[-1]) + 1 + len(content) <= CONTENT_MAX_LENGTH:
+                    groups[-1].append(candidate)
+                    contents[-1] = contents[-1] + "\n" + content
+                    continue
+                content = candidate.document.page_content
+            groups.append([candidate])
+            contents.append(content)
+
+        merged = [self._merge(group, content) for group, content in zip(groups, contents)]
+        order = sorted(range(len(groups)), key=lambda index: min((candidate.score is None, -(candidate.score or 0),
+                                                                  candidate.rank) for candidate in groups[index]))
+        return [merged[index] for index in order]
+
+    @staticmethod
+    def _merge(group: List[_Candidate], content: str) -> Document:
+        first = group[0].document
+        scores = [candidate.score for candidate in group if candidate.score is not None]
+        metadata = dict(first.metadata)
+        metadata["_score"] = max(scores) if scores else None
+        if len(group) > 1:
+            metadata["merged_on_page_indexes"] = [candidate.document.metadata.get("on_page_index")
+                                                  for candidate in group]
+        return Document(page_content=content, metadata=metadata)
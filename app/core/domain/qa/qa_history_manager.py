@@ -0,0 +1,132 @@
+import copy
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
+
+from app.core.domain.qa.qa_context_packer import default_tokenizer
+from app.core.domain.qa.qa_prompts_service import HISTORY_SUMMARY_PROMPT
+from app.core.external_services.llm.llm_port import LlmModel
+from app.models.objects.chat_history_model import ChatHistory
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+QA_HISTORY_WINDOW_ENABLED = os.getenv("QA_HISTORY_WINDOW_ENABLED", "true").lower() == "true"
+# Tokens of the most recent messages that are sent as they are, older messages are summarized
+QA_HISTORY_WINDOW_TOKENS = int(os.getenv("QA_HISTORY_WINDOW_TOKENS", 1000))
+# Older messages are only summarized once at least this many of them are not covered by a summary yet.
+# Until then they stay in the window, so the summary is not extended on every turn.
+QA_HISTORY_SUMMARY_STEP = int(os.getenv("QA_HISTORY_SUMMARY_STEP", 4))
+QA_HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv("QA_HISTORY_SUMMARY_CACHE_SIZE", 4096))
+# Cheaper or faster model for the summaries. Defaults to the model of the request.
+QA_HISTORY_SUMMARY_MODEL = os.getenv("QA_HISTORY_SUMMARY_MODEL")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+class ChatHistoryManager:
+    """
+    Reduces the chat history that is sent to the llm to the most recent messages within a token budget and a rolling
+    summary of the older messages. Summaries are cached by conversation and hash of the summarized prefix. A new
+    summary extends the summary of the longest cached prefix with the messages after it, so each message is
+    summarized once per conversation.
+    """
+
+    def __init__(self,
+                 window_tokens: int = QA_HISTORY_WINDOW_TOKENS,
+                 summary_step: int = QA_HISTORY_SUMMARY_STEP,
+                 cache_size: int = QA_HISTORY_SUMMARY_CACHE_SIZE,
+                 summary_model: Optional[str] = QA_HISTORY_SUMMARY_MODEL,
+                 tokenizer=None):
+        self.window_tokens = window_tokens
+        self.summary_step = summary_step
+        self.cache_size = cache_size
+        self.summary_model = summary_model
+        self._tokenizer = tokenizer
+        self.summary_prompt = ChatPromptTemplate.from_messages(
+            [("system", HISTORY_SUMMARY_PROMPT), MessagesPlaceholder("new_lines")]
+        )
+        self._summaries: OrderedDict[Tuple[str, str], str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = default_tokenizer()
+        return self._tokenizer
+
+    async def aprepare(self, chat_history: ChatHistory, config: RunnableConfig) -> List[BaseMessage]:
+        """Returns the messages for the prompts: the summary of the older messages, if any, and the recent window."""
+        messages = chat_history.to_langchain_messages()
+        window_start = self._window_start(messages)
+        if window_start == 0:
+            return messages
+
+        conversation_id = config["configurable"].get("conversation_id") or ""
+        prefix_hashes = chat_history.prefix_hashes()
+        summarized, summary = self._cached_summary(conversation_id, prefix_hashes, window_start)
+
+        if window_start - summarized >= self.summary_step:
+            try:
+                new_summary = await self._summarize(summary, messages[summarized:window_start], config)
+            except Exception as e:
+                # The request must not fail because of the summary: the cached summary is used and the messages
+                # after it are kept, so no message is dropped
+                logger.log(level="warning", func_name="ChatHistoryManager.aprepare",
+                           message=f"Could not summarize the chat history: {e}")
+            else:
+                summary = new_summary
+                self._remember(conversation_id, prefix_hashes[window_start], summary)
+                summarized = window_start
+
+        window = messages[summarized:]
+        logger.log(level="debug", func_name="ChatHistoryManager.aprepare",
+                   message=f"Chat history of {len(messages)} messages reduced to {len(window)} messages"
+                           f"{' and a summary' if summary else ''}")
+        if not summary:
+            return window
+        return [SystemMessage(content=SUMMARY_PREFIX + summary)] + window
+
+    def _window_start(self, messages: List[BaseMessage]) -> int:
+        """Index of the oldest message of the window. The latest message is always part of it."""
+        used_tokens = 0
+        for index in range(len(messages) - 1, -1, -1):
+            used_tokens += len(self.tokenizer.encode(messages[index].content))
+            if used_tokens > self.window_tokens:
+                return min(index + 1, len(messages) - 1)
+        return 0
+
+    def _cached_summary(self, conversation_id: str, prefix_hashes: List[str], window_start: int) -> Tuple[int, str]:
+        """Longest summarized prefix of the messages before the window and its summary."""
+        with self._lock:
+            for length in range(window_start, 0, -1):
+                key = (conversation_id, prefix_hashes[length])
+                if key in self._summaries:
+                    self._summaries.move_to_end(key)
+                    return length, self._summaries[key]
+        return 0, ""
+
+    async def _summarize(self, summary: str, new_lines: List[BaseMessage], config: RunnableConfig) -> str:
+        llm: LlmModel = config["configurable"]["llm"]
+        if self.summary_model:
+            # Same api key and settings, only the model is replaced
+            llm = copy.copy(llm)
+            llm.set_model(self.summary_model)
+        chain = self.summary_prompt | llm.get_llm() | StrOutputParser()
+        return await chain.ainvoke({"summary": summary or "(empty)", "new_lines": new_lines},
+                                   config={"callbacks": config.get("callbacks"), "run_name": "summarize_history"})
+
+    def _remember(self, conversation_id: str, prefix_hash: str, summary: str):
+        with self._lock:
+            self._summaries[(conversation_id, prefix_hash)] = summary
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
@@ -21,3 +21,6 @@ class QAPromptsInterface(ABC):
     def set_llm_prompt_with_context(self, prompt: str):
         pass
 
+    @abstractmethod
+    def get_prompt_set_key(self) -> tuple:
+        pass
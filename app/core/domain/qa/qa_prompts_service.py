@@ -14,11 +14,20 @@ LLM_PROMPT_WITH_CONTEXT = """You are a helpful assistant for question-answering
                    Use five sentences maximum and keep the answer concise.
                    {context}"""
 
+HISTORY_SUMMARY_PROMPT = """Progressively summarize the lines of a conversation between a user and an assistant. 
+        Extend the current summary with the new lines and return only the new summary. Keep names, numbers, documents 
+        and open questions the user may refer to later. Use at most ten sentences.
+
+        Current summary:
+        {summary}"""
+
 
 class QAPromptsService(QAPromptsInterface):
     def __init__(self):
         self._history_aware_prompt = None
         self._llm_prompt_with_context = None
+        self._history_aware_prompt_text = VECTOR_STORE_RETRIEVER_PROMPT
+        self._llm_prompt_with_context_text = LLM_PROMPT_WITH_CONTEXT
 
     def get_history_aware_prompt_for_vector_store_retriever(self) -> ChatPromptTemplate:
         """Returns the history-aware prompt for the vector store retriever."""
@@ -28,6 +37,7 @@ class QAPromptsService(QAPromptsInterface):
 
     def set_history_aware_prompt_for_vector_store_retriever(self, prompt: str = VECTOR_STORE_RETRIEVER_PROMPT):
         """Sets the history-aware prompt for the vector store retriever."""
+        self._history_aware_prompt_text = prompt
         self._history_aware_prompt = ChatPromptTemplate.from_messages(
             [("system", prompt), MessagesPlaceholder("chat_history"), ("human", "{input}")]
         )
@@ -40,6 +50,11 @@ class QAPromptsService(QAPromptsInterface):
 
     def set_llm_prompt_with_context(self, prompt: str = LLM_PROMPT_WITH_CONTEXT):
         """Sets the LLM prompt with context."""
+        self._llm_prompt_with_context_text = prompt
         self._llm_prompt_with_context = ChatPromptTemplate.from_messages(
             [("system", prompt), MessagesPlaceholder("chat_history"), ("human", "{input}")]
         )
+
+    def get_prompt_set_key(self) -> tuple:
+        """Identifies the prompt set, chains built from prompt sets with the same key are interchangeable."""
+        return self._history_aware_prompt_text, self._llm_prompt_with_context_text
@@ -0,0 +1,88 @@
+import os
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client import models
+
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import SPARSE_VECTOR_NAME
+from app.core.external_services.embedding.sparse_encoder import BM25SparseEncoder
+
+load_dotenv()
+
+COLLECTION_NAME = os.getenv("VECTOR_STORE_COLLECTION")
+# Each of the dense and the sparse search contributes k * HYBRID_PREFETCH_FACTOR candidates to the fusion
+HYBRID_PREFETCH_FACTOR = int(os.getenv("HYBRID_PREFETCH_FACTOR", 4))
+
+
+def hybrid_query(dense_vector: List[float],
+                 sparse_vector: models.SparseVector,
+                 query_filter: Optional[models.Filter],
+                 limit: int,
+                 search_params: Optional[models.SearchParams] = None,
+                 prefetch_factor: int = HYBRID_PREFETCH_FACTOR) -> dict:
+    """
+    Arguments of query_points for a dense and a sparse search whose results are fused with reciprocal rank fusion.
+    Both searches and the fusion run in one request.
+    """
+    prefetch_limit = limit * prefetch_factor
+    return {
+        "prefetch": [
+            models.Prefetch(query=dense_vector, filter=query_filter, params=search_params, limit=prefetch_limit),
+            models.Prefetch(query=sparse_vector, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=prefetch_limit),
+        ],
+        "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        "query_filter": query_filter,
+        "limit": limit,
+    }
+
+
+class QdrantHybridRetriever(BaseRetriever):
+    """Retrieves the chunks of a dense and a sparse (BM25) search, fused by Qdrant with reciprocal rank fusion."""
+
+    client: Any
+    async_client: Any
+    embeddings: Any
+    sparse_encoder: Any = BM25SparseEncoder()
+    filter: Optional[models.Filter] = None
+    search_params: Optional[models.SearchParams] = None
+    collection_name: str = COLLECTION_NAME
+    k: int = 5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        response = self.client.query_points(collection_name=self.collection_name,
+                                            with_payload=True,
+                                            **hybrid_query(self.embeddings.embed_query(query),
+                                                           self.sparse_encoder.encode_query(query),
+                                                           query_filter=self.filter,
+                                                           limit=self.k,
+                                                           search_params=self.search_params))
+        return self._to_documents(response.points)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        response = await self.async_client.query_points(collection_name=self.collection_name,
+                                                        with_payload=True,
+                                                        **hybrid_query(await self.embeddings.aembed_query(query),
+                                                                       self.sparse_encoder.encode_query(query),
+                                                                       query_filter=self.filter,
+                                                                       limit=self.k,
+                                                                       search_params=self.search_params))
+        return self._to_documents(response.points)
+
+    def _to_documents(self, points: List[models.ScoredPoint]) -> List[Document]:
+        # Same documents as the langchain Qdrant store
+        documents = []
+        for point in points:
+            metadata = point.payload.get("metadata") or {}
+            metadata["_id"] = point.id
+            metadata["_collection_name"] = self.collection_name
+            metadata["_score"] = point.score
+            documents.append(Document(page_content=point.payload.get("page_content"), metadata=metadata))
+        return documents
@@ -0,0 +1,127 @@
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client import models
+
+load_dotenv()
+
+COLLECTION_NAME = os.getenv("VECTOR_STORE_COLLECTION")
+
+
+def maximal_marginal_relevance(query_vector: np.ndarray, candidate_vectors: np.ndarray, k: int,
+                               lambda_mult: float) -> List[int]:
+    """
+    Returns the indexes of the k candidates that maximize the marginal relevance, in selection order. Every step
+    is one matrix-vector product: the similarity of each candidate to its closest selected candidate is kept up to
+    date instead of being recomputed against all selected candidates.
+    """
+    k = min(k, len(candidate_vectors))
+    if k <= 0:
+        return []
+
+    candidates = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    similarity_to_query = candidates @ _normalize(np.asarray(query_vector, dtype=np.float32))
+
+    selected = [int(np.argmax(similarity_to_query))]
+    similarity_to_selected = candidates @ candidates[selected[0]]
+
+    while len(selected) < k:
+        scores = lambda_mult * similarity_to_query - (1 - lambda_mult) * similarity_to_selected
+        scores[selected] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        np.maximum(similarity_to_selected, candidates @ candidates[index], out=similarity_to_selected)
+
+    return selected
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _dense_vector(vector) -> List[float]:
+    # Collections with sparse vectors return all vectors of a point by name, the dense one is the unnamed vector
+    return vector[""] if isinstance(vector, dict) else vector
+
+
+class QdrantMMRRetriever(BaseRetriever):
+    """
+    MMR retriever that fetches the fetch_k candidates with their vectors but without payloads, selects k of them
+    with a vectorized MMR pass and only retrieves the payloads of the selected points.
+    """
+
+    client: Any
+    async_client: Any
+    embeddings: Any
+    filter: Optional[models.Filter] = None
+    search_params: Optional[models.SearchParams] = None
+    collection_name: str = COLLECTION_NAME
+    k: int = 5
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        candidates = self.client.query_points(**self._candidates_request(query_vector)).points
+        selected = self._select(query_vector, candidates)
+        if not selected:
+            return []
+        records = self.client.retrieve(collection_name=self.collection_name, ids=[point.id for point in selected],
+                                       with_payload=True, with_vectors=False)
+        return self._to_documents(selected, records)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        candidates = (await self.async_client.query_points(**self._candidates_request(query_vector))).points
+        selected = self._select(query_vector, candidates)
+        if not selected:
+            return []
+        records = await self.async_client.retrieve(collection_name=self.collection_name,
+                                                   ids=[point.id for point in selected],
+                                                   with_payload=True, with_vectors=False)
+        return self._to_documents(selected, records)
+
+    def _candidates_request(self, query_vector: List[float]) -> dict:
+        return {
+            "collection_name": self.collection_name,
+            "query": query_vector,
+            "query_filter": self.filter,
+            "search_params": self.search_params,
+            "limit": max(self.fetch_k, self.k),
+            "with_payload": False,
+            "with_vectors": True,
+        }
+
+    def _select(self, query_vector: List[float], candidates: List[models.ScoredPoint]) -> List[models.ScoredPoint]:
+        if not candidates:
+            return []
+        indexes = maximal_marginal_relevance(np.asarray(query_vector),
+                                             np.asarray([_dense_vector(point.vector) for point in candidates]),
+                                             k=self.k, lambda_mult=self.lambda_mult)
+        return [candidates[index] for index in indexes]
+
+    def _to_documents(self, selected: List[models.ScoredPoint], records: List[models.Record]) -> List[Document]:
+        # Same documents as the langchain Qdrant store, in MMR order
+        payloads = {record.id: record.payload for record in records}
+        documents = []
+        for point in selected:
+            payload = payloads.get(point.id)
+            if payload is None:
+                continue
+            metadata = payload.get("metadata") or {}
+            metadata["_id"] = point.id
+            metadata["_collection_name"] = self.collection_name
+            metadata["_score"] = point.score
+            documents.append(Document(page_content=payload.get("page_content"), metadata=metadata))
+        return documents
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, List
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.core.utils.logger import Logger
+from app.core.utils.singleton import SingletonMeta
+
+try:
+    import torch
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Reranking is optional, without sentence-transformers the retrieved order is kept
+    torch = None
+    CrossEncoder = None
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+RERANKER_ENABLED = os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Number of candidates retrieved for reranking, the best k of them are passed to the llm
+RERANKER_CANDIDATES = int(os.getenv("RERANKER_CANDIDATES", 20))
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", 16))
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", 512))
+# Threads that score candidates. More concurrent rerankings than threads are not queued, they keep the order.
+RERANKER_WORKERS = int(os.getenv("RERANKER_WORKERS", 2))
+# Torch threads of one scoring. Torch uses all cores by default, so the workers would take workers x cores threads
+# from the event loop and the process pools.
+RERANKER_TORCH_THREADS = int(os.getenv("RERANKER_TORCH_THREADS", 1))
+# Seconds a request waits for the scores before it falls back to the retrieved order
+RERANKER_TIMEOUT = float(os.getenv("RERANKER_TIMEOUT", 0.5))
+
+
+def reranker_available() -> bool:
+    return RERANKER_ENABLED and CrossEncoder is not None
+
+
+class CrossEncoderReranker(metaclass=SingletonMeta):
+    """
+    Scores (query, chunk) pairs with a small local cross-encoder on the CPU. Scoring runs in a bounded thread
+    pool, each scoring with at most torch_threads torch threads, and every request waits at most the time budget for
+    it. If the budget is exceeded, all workers are busy or the model fails, the documents are returned in the
+    retrieved order. The model is loaded on first use.
+    """
+
+    def __init__(self,
+                 model_name: str = RERANKER_MODEL,
+                 batch_size: int = RERANKER_BATCH_SIZE,
+                 max_length: int = RERANKER_MAX_LENGTH,
+                 workers: int = RERANKER_WORKERS,
+                 timeout: float = RERANKER_TIMEOUT,
+                 torch_threads: int = RERANKER_TORCH_THREADS):
+        self.model_name = model_name
+        self.torch_threads = torch_threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.timeout = timeout
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reranker")
+        # Scorings that time out keep running, the slots stop new work from piling up behind them
+        self._slots = threading.BoundedSemaphore(workers)
+
+        self.reranked = 0
+        self.fallbacks = 0
+
+    def warm_up(self):
+        """Loads the model in the background, so that the first requests do not spend their budget on it."""
+        self._executor.submit(self._get_model)
+
+    def rerank(self, query: str, documents: List[Document], top_n: int) -> List[Document]:
+        if len(documents) <= 1:
+            return documents
+        future = self._submit(query, documents)
+        if future is None:
+            return self._fallback(documents, top_n, "all reranker workers are busy")
+        try:
+            scores = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            return self._fallback(documents, top_n, f"reranking took more than {self.timeout}s")
+        except Exception as e:
+            return self._fallback(documents, top_n, str(e))
+        return self._select(documents, scores, top_n)
+
+    async def arerank(self, query: str, documents: List[Document], top_n: int) -> List[Document]:
+        if len(documents) <= 1:
+            return documents
+        future = self._submit(query, documents)
+        if future is None:
+            return self._fallback(documents, top_n, "all reranker workers are busy")
+        try:
+            # shield: a timeout must not cancel the scoring, the slot is only released when it ends
+            scores = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return self._fallback(documents, top_n, f"reranking took more than {self.timeout}s")
+        except Exception as e:
+            return self._fallback(documents, top_n, str(e))
+        return self._select(documents, scores, top_n)
+
+    def stats(self) -> dict:
+        return {"reranked": self.reranked, "fallbacks": self.fallbacks}
+
+    def _submit(self, query: str, documents: List[Document]):
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return self._executor.submit(self._score, query, [document.page_content for document in documents])
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        try:
+            scores = self._get_model().predict([(query, text) for text in texts], batch_size=self.batch_size,
+                                               show_progress_bar=False)
+            return [float(score) for score in scores]
+        finally:
+            self._slots.release()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # Process-wide setting, the reranker is the only torch user of the app
+                    torch.set_num_threads(self.torch_threads)
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        return self._model
+
+    def _select(self, documents: List[Document], scores: List[float], top_n: int) -> List[Document]:
+        self.reranked += 1
+        ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)[:top_n]
+        for document, score in ranked:
+            document.metadata["rerank_score"] = score
+        return [document for document, _ in ranked]
+
+    def _fallback(self, documents: List[Document], top_n: int, reason: str) -> List[Document]:
+        self.fallbacks += 1
+        logger.log(level="warning", func_name="CrossEncoderReranker",
+                   message=f"Keeping the retrieved order, {reason}. Stats: {self.stats()}")
+        return documents[:top_n]
+
+
+class RerankingRetriever(BaseRetriever):
+    """Retrieves the candidates with the wrapped retriever and keeps the top_n of them ranked by the reranker."""
+
+    retriever: Any
+    reranker: Any
+    top_n: int = 5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self.reranker.rerank(query, documents, self.top_n)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return await self.reranker.arerank(query, documents, self.top_n)
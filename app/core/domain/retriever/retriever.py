@@ -2,6 +2,7 @@ import os
 from abc import abstractmethod, ABC
 from typing import Optional
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
+from app.core.external_services.embedding.embedding_port import EmbeddingModel
 import os
 from dotenv import load_dotenv
 
@@ -10,6 +11,7 @@ load_dotenv()
 
 class Retriever(ABC):
     vector_store: VectorStore
+    embedding_model: EmbeddingModel
 
     @abstractmethod
     def _filter_conditions(self,
@@ -24,6 +26,8 @@ class Retriever(ABC):
                           document_id: Optional[str] = None,
                           conversation_id: Optional[str] = None,
                           k: int = int(os.getenv("MAX_K_RESULTS")),
+                          fetch_k: int = int(os.getenv("MMR_FETCH_K", 20)),
+                          lambda_mult: float = float(os.getenv("LAMBDA_MULT")),
                           ):
         pass
 
@@ -35,3 +39,12 @@ class Retriever(ABC):
                                  k: int = int(os.getenv("MAX_K_RESULTS")),
                                  ):
         pass
+
+    @abstractmethod
+    def get_hybrid_retriever(self,
+                             user_id: str,
+                             document_id: Optional[str] = None,
+                             conversation_id: Optional[str] = None,
+                             k: int = int(os.getenv("MAX_K_RESULTS")),
+                             ):
+        pass
@@ -6,12 +6,18 @@ from dotenv import load_dotenv
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
 from app.core.domain.retriever.retriever import Retriever
+from app.core.domain.retriever.mmr_retriever import QdrantMMRRetriever
+from app.core.domain.retriever.hybrid_retriever import QdrantHybridRetriever
+from app.core.utils.logger import Logger
 from qdrant_client import models
 
 load_dotenv()
 
+logger = Logger('Logger')
+
 MAX_K_RESULTS = os.getenv("MAX_K_RESULTS")
 LAMBDA_MULT = float(os.getenv("LAMBDA_MULT"))
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", 20))
 
 
 class QdrantRetriever(Retriever):
@@ -58,23 +64,25 @@ class QdrantRetriever(Retriever):
                           user_id: str,
                           document_id: Optional[str] = None,
                           conversation_id: Optional[str] = None,
-                          k: int = int(MAX_K_RESULTS)):
+                          k: int = int(MAX_K_RESULTS),
+                          fetch_k: int = MMR_FETCH_K,
+                          lambda_mult: float = LAMBDA_MULT):
 
         must_conditions = self._filter_conditions(user_id=user_id,
                                                   document_id=document_id,
                                                   conversation_id=conversation_id)
 
-        vector_store_connection = self.vector_store.get_connection(embedding_model=self.embedding_model)
-        return vector_store_connection.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k": k,  # Number of documents to return; Default is 5
-                "fetch_k": 20,  # Number of documents to pass into mmr algorithm; Default is 20
-                "lambda_mult": LAMBDA_MULT,  # Diversity of Documents. Default = 0.5, Minimum = 1, Maximum = 0
-                "filter": models.Filter(
-                    must=must_conditions  # Filter for metadata
-                )
-            }
+        return QdrantMMRRetriever(
+            client=self.vector_store.get_client(),
+            async_client=self.vector_store.get_async_client(),
+            embeddings=self.embedding_model.get_model(),
+            k=k,  # Number of documents to return
+            fetch_k=fetch_k,  # Number of candidates passed into the mmr algorithm
+            lambda_mult=lambda_mult,  # Diversity of Documents. 1 = minimum diversity, 0 = maximum diversity
+            filter=models.Filter(
+                must=must_conditions  # Filter for metadata
+            ),
+            search_params=self.vector_store.get_search_params(),  # hnsw_ef and rescoring of the profile
         )
 
     def get_similarity_retriever(self,
@@ -96,6 +104,34 @@ class QdrantRetriever(Retriever):
                 "score_threshold": 0.8,
                 "filter": models.Filter(
                     must=must_conditions  # Filter for metadata
-                )
+                ),
+                "search_params": self.vector_store.get_search_params(),  # hnsw_ef and rescoring of the profile
             }
         )
+
+    def get_hybrid_retriever(self,
+                             user_id: str,
+                             document_id: Optional[str] = None,
+                             conversation_id: Optional[str] = None,
+                             k: int = int(MAX_K_RESULTS)):
+
+        if not self.vector_store.supports_sparse_vectors():
+            logger.log(level="warning", func_name="QdrantRetriever.get_hybrid_retriever",
+                       message="The collection has no sparse vectors, falling back to the mmr retriever")
+            return self.get_mmr_retriever(user_id=user_id, document_id=document_id,
+                                          conversation_id=conversation_id, k=k)
+
+        must_conditions = self._filter_conditions(user_id=user_id,
+                                                  document_id=document_id,
+                                                  conversation_id=conversation_id)
+
+        return QdrantHybridRetriever(
+            client=self.vector_store.get_client(),
+            async_client=self.vector_store.get_async_client(),
+            embeddings=self.embedding_model.get_model(),
+            k=k,  # Number of documents to return after the fusion
+            filter=models.Filter(
+                must=must_conditions  # Filter for metadata
+            ),
+            search_params=self.vector_store.get_search_params(),  # hnsw_ef and rescoring of the dense search
+        )
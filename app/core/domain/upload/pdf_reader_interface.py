@@ -1,8 +1,15 @@
 from abc import ABC, abstractmethod
 from io import BytesIO
+from typing import AsyncIterator
+
+from langchain_core.documents import Document
 
 
 class PDFReader(ABC):
     @abstractmethod
     def read_pdf(self, file):  # -> str:
         pass
+
+    @abstractmethod
+    def iter_pages(self, file) -> AsyncIterator[Document]:
+        pass
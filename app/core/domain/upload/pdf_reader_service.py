@@ -1,38 +1,149 @@
+import asyncio
+import math
 import os
-import tempfile
-import time
-from aiofile import AIOFile
-from langchain_community.document_loaders import PyMuPDFLoader
+from multiprocessing import shared_memory
+from typing import AsyncIterator, List, Optional, Tuple
+
+import pymupdf
+from dotenv import load_dotenv
+from langchain_core.documents import Document
 
 from app.core.domain.upload.pdf_reader_interface import PDFReader
 from app.core.utils.logger import Logger
+from app.core.utils.process_pools import get_process_pool, start_process_pool
+
+load_dotenv()
 
 logger = Logger('Logger')
 
+# Documents with at least this many pages are parsed by several processes
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", 100))
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", os.cpu_count() or 1))
+
+PROCESS_POOL_NAME = "pdf_reader"
+
+# Document the worker process opened last, as (shared memory name, document)
+_worker_document: Optional[Tuple[str, pymupdf.Document]] = None
+
+
+def _open_shared_document(name: str, size: int) -> pymupdf.Document:
+    """Opens the PDF in the shared memory block once per worker, later shards of the same upload reuse it."""
+    global _worker_document
+    if _worker_document is not None and _worker_document[0] == name:
+        return _worker_document[1]
+    if _worker_document is not None:
+        _worker_document[1].close()
+        _worker_document = None
+
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        file = bytes(block.buf[:size])
+    finally:
+        block.close()
+    _worker_document = (name, pymupdf.open(stream=file, filetype="pdf"))
+    return _worker_document[1]
+
+
+def _init_worker():
+    # Unpickling this initializer imports the module and PyMuPDF in the worker while the pool starts
+    pass
+
+
+def _extract_page_range(name: str, size: int, start: int, stop: int) -> List[str]:
+    """Runs in a worker process and returns the text of the pages [start, stop) in page order."""
+    doc = _open_shared_document(name, size)
+    return [doc[page_index].get_text() for page_index in range(start, stop)]
+
 
 class PDFReaderService(PDFReader):
+    """
+    Parses PDFs straight from the uploaded bytes, without a round trip through a temporary file. The parsing itself
+    runs in worker threads, so the event loop stays free while large documents are read. Documents with at least
+    PDF_PARALLEL_PAGE_THRESHOLD pages are sharded into page ranges that are parsed by a process pool, once the pool
+    was started with start_process_pool. The file is copied once into shared memory instead of being sent with every
+    shard, and each worker opens it once.
+    """
+
+    def __init__(self,
+                 parallel_page_threshold: int = PDF_PARALLEL_PAGE_THRESHOLD,
+                 parallel_workers: int = PDF_PARALLEL_WORKERS):
+        self.parallel_page_threshold = parallel_page_threshold
+        self.parallel_workers = parallel_workers
+
     @staticmethod
+    def start_process_pool(parallel_workers: int = PDF_PARALLEL_WORKERS):
+        if parallel_workers > 1:
+            start_process_pool(PROCESS_POOL_NAME, max_workers=parallel_workers, initializer=_init_worker)
+
     @logger.log_decorator(level="debug", message="Reading in PDF")
-    async def read_pdf(file):
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        temp_filename = temp_file.name
+    async def read_pdf(self, file) -> List[Document]:
+        return [page async for page in self.iter_pages(file)]
+
+    @logger.log_decorator(level="debug", message="Streaming PDF pages")
+    async def iter_pages(self, file) -> AsyncIterator[Document]:
+        """Yields the pages of the PDF one by one and in page order."""
+        doc = await asyncio.to_thread(self._open, file)
+        if self._use_process_pool(doc.page_count):
+            pages = self._iter_pages_parallel(file, doc.page_count)
+        else:
+            pages = self._iter_pages_sequential(doc)
         try:
-            async with AIOFile(temp_filename, 'wb') as afp:
-                await afp.write(file)
-                await afp.fsync()
+            async for page in pages:
+                yield page
+        finally:
+            # Closes the page iterator right away if the caller stops early, which releases its shared memory
+            await pages.aclose()
+            doc.close()
+
+    def _use_process_pool(self, page_count: int) -> bool:
+        return (self.parallel_workers > 1 and page_count >= self.parallel_page_threshold
+                and get_process_pool(PROCESS_POOL_NAME) is not None)
+
+    async def _iter_pages_sequential(self, doc: pymupdf.Document) -> AsyncIterator[Document]:
+        # Each page is parsed in a worker thread when it is requested
+        for page_index in range(doc.page_count):
+            yield await asyncio.to_thread(self._read_page, doc, page_index)
 
-            # Read in PDF
-            loader = PyMuPDFLoader(file_path=temp_filename)
-            data = loader.load()
+    async def _iter_pages_parallel(self, file, page_count: int) -> AsyncIterator[Document]:
+        # Two shards per worker, so the first pages are available before the whole document is parsed
+        shard_size = math.ceil(page_count / (self.parallel_workers * 2))
+        pool = get_process_pool(PROCESS_POOL_NAME)
+        loop = asyncio.get_running_loop()
+        block = shared_memory.SharedMemory(create=True, size=len(file))
+        shards = []
+        try:
+            block.buf[:len(file)] = file
+            shards = [
+                (start, loop.run_in_executor(pool, _extract_page_range, block.name, len(file), start,
+                                             min(start + shard_size, page_count)))
+                for start in range(0, page_count, shard_size)
+            ]
 
-            # Delete resources
-            del loader
+            logger.log(level="debug", func_name="PDFReaderService.iter_pages",
+                       message=f"Parsing {page_count} pages in {len(shards)} shards")
 
+            # The shards are awaited in order, which reassembles the pages in page order
+            for start, shard in shards:
+                for page_index, text in enumerate(await shard, start=start):
+                    yield self._page_document(text, page_index, page_count)
         finally:
-            # Ensure file is not blocked by the os
-            time.sleep(0.1)
-            os.unlink(temp_filename)
+            for _, shard in shards:
+                shard.cancel()
+            # Shards that are still running when the upload stops early can no longer attach, nobody waits for them
+            block.close()
+            block.unlink()
+
+    @staticmethod
+    def _open(file) -> pymupdf.Document:
+        # The buffer is handed to PyMuPDF as is, it is neither copied nor written to disk
+        return pymupdf.open(stream=file, filetype="pdf")
 
-        # return data
-        return data
+    @staticmethod
+    def _read_page(doc: pymupdf.Document, page_index: int) -> Document:
+        return PDFReaderService._page_document(doc[page_index].get_text(), page_index, doc.page_count)
+
+    @staticmethod
+    def _page_document(text: str, page_index: int, page_count: int) -> Document:
+        # The page text and its zero based page index, like the PyMuPDFLoader of langchain, without the other
+        # metadata of the loader
+        return Document(page_content=text, metadata={"page": page_index, "total_pages": page_count})
@@ -0,0 +1,120 @@
+import os
+import re
+from functools import lru_cache
+from typing import Any, List, Literal
+
+from dotenv import load_dotenv
+
+from app.core.utils.logger import Logger
+from app.core.utils.process_pools import get_process_pool, start_process_pool
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+# spacy: sentences from the dependency parser of the model, the most accurate and slowest mode
+# sentencizer: rule based sentence boundaries of spaCy, no model is loaded
+# regex: sentence boundaries from punctuation, without spaCy
+# token: chunks bounded in tokens of the embedding model instead of characters (see TokenChunker)
+SplitterMode = Literal["spacy", "sentencizer", "regex", "token"]
+
+TEXT_SPLITTER_MODE: SplitterMode = os.getenv("TEXT_SPLITTER_MODE", "spacy")
+TEXT_SPLITTER_SPACY_MODEL = os.getenv("TEXT_SPLITTER_SPACY_MODEL", "en_core_web_sm")
+# Batches of at least this many pages are split by several processes
+TEXT_SPLITTER_PARALLEL_PAGE_THRESHOLD = int(os.getenv("TEXT_SPLITTER_PARALLEL_PAGE_THRESHOLD", 32))
+TEXT_SPLITTER_PROCESSES = int(os.getenv("TEXT_SPLITTER_PROCESSES", os.cpu_count() or 1))
+TEXT_SPLITTER_PIPE_BATCH_SIZE = int(os.getenv("TEXT_SPLITTER_PIPE_BATCH_SIZE", 16))
+TEXT_SPLITTER_MAX_LENGTH = int(os.getenv("TEXT_SPLITTER_MAX_LENGTH", 1_000_000))
+
+# Only the parser sets sentence boundaries, the other components of the model are not loaded
+SPACY_EXCLUDED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+# A sentence ends with punctuation followed by whitespace and no lowercase letter ("e.g. the" is not split),
+# paragraphs always end a sentence
+REGEX_SENTENCE_BOUNDARY = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+(?=[^a-z\s])|\n\s*\n")
+
+
+@lru_cache(maxsize=None)
+def load_pipeline(mode: SplitterMode, model: str = TEXT_SPLITTER_SPACY_MODEL) -> Any:
+    """Loads the spaCy pipeline of a mode once per process."""
+    import spacy  # Not needed in regex mode
+
+    if mode == "sentencizer":
+        from spacy.lang.en import English
+        nlp = English()
+        nlp.add_pipe("sentencizer")
+    else:
+        nlp = spacy.load(model, exclude=SPACY_EXCLUDED_COMPONENTS)
+    nlp.max_length = TEXT_SPLITTER_MAX_LENGTH
+    logger.log(level="debug", func_name="load_pipeline",
+               message=f"Loaded {mode} pipeline with components {nlp.pipe_names} in process {os.getpid()}")
+    return nlp
+
+
+def regex_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in REGEX_SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+
+def split_sentences(texts: List[str], mode: SplitterMode, model: str = TEXT_SPLITTER_SPACY_MODEL,
+                    batch_size: int = TEXT_SPLITTER_PIPE_BATCH_SIZE) -> List[List[str]]:
+    """Sentences of each text, in the process that calls it."""
+    if mode == "regex":
+        return [regex_sentences(text) for text in texts]
+    nlp = load_pipeline(mode, model)
+    return [[sentence.text.strip() for sentence in doc.sents if sentence.text.strip()]
+            for doc in nlp.pipe(texts, batch_size=batch_size)]
+
+
+def _init_worker(mode: SplitterMode, model: str):
+    load_pipeline(mode, model)
+
+
+def _process_pool_name(mode: SplitterMode, model: str) -> str:
+    # One pool per pipeline, each worker loads the pipeline once when it starts
+    return f"sentence_splitter/{mode}/{model}"
+
+
+class SentenceSplitter:
+    """
+    Splits page texts into sentences. The spaCy pipeline is loaded once per process. Batches of pages run through
+    nlp.pipe, large batches are sharded across a process pool whose workers keep their pipeline between uploads.
+    The pool is started with start_process_pool in the lifespan of the app, until then all batches are split in the
+    calling process.
+    """
+
+    def __init__(self,
+                 mode: SplitterMode = TEXT_SPLITTER_MODE,
+                 model: str = TEXT_SPLITTER_SPACY_MODEL,
+                 processes: int = TEXT_SPLITTER_PROCESSES,
+                 parallel_page_threshold: int = TEXT_SPLITTER_PARALLEL_PAGE_THRESHOLD):
+        self.mode = mode
+        self.model = model
+        self.processes = processes
+        self.parallel_page_threshold = parallel_page_threshold
+
+    def warm_up(self):
+        """Loads the pipeline in this process, so the first upload does not wait for it."""
+        if self.mode != "regex":
+            load_pipeline(self.mode, self.model)
+
+    def start_process_pool(self):
+        if self.mode != "regex" and self.processes > 1:
+            start_process_pool(_process_pool_name(self.mode, self.model), max_workers=self.processes,
+                               initializer=_init_worker, initargs=(self.mode, self.model))
+
+    def sentences(self, text: str) -> List[str]:
+        return split_sentences([text], self.mode, self.model)[0]
+
+    def sentences_batch(self, texts: List[str]) -> List[List[str]]:
+        if not self._use_process_pool(len(texts)):
+            return split_sentences(texts, self.mode, self.model)
+
+        pool = get_process_pool(_process_pool_name(self.mode, self.model))
+        shard_size = -(-len(texts) // self.processes)
+        shards = [pool.submit(split_sentences, texts[start:start + shard_size], self.mode, self.model)
+                  for start in range(0, len(texts), shard_size)]
+        return [sentences for shard in shards for sentences in shard.result()]
+
+    def _use_process_pool(self, pages: int) -> bool:
+        # Regex splitting is cheaper than sending the pages to another process
+        return (self.mode != "regex" and self.processes > 1 and pages >= self.parallel_page_threshold
+                and get_process_pool(_process_pool_name(self.mode, self.model)) is not None)
@@ -1,10 +1,28 @@
 from abc import ABC, abstractmethod
 from typing import List
 
-from app.core.domain.chunks.chunk_model import ChunkModel
+from app.core.domain.chunks.chunk_model import ChunkRecord
 
 
 class TextSplitter(ABC):
     @abstractmethod
-    def split_text(self, text, document_id: str, owner_id: str, conversation_id: str) -> List[ChunkModel]:
+    def split_text(self, text, document_id: str, owner_id: str, conversation_id: str) -> List[ChunkRecord]:
+        pass
+
+    @abstractmethod
+    def split_page(self, page, page_number: int, document_id: str, owner_id: str,
+                   conversation_id: str) -> List[ChunkRecord]:
+        pass
+
+    @abstractmethod
+    def split_pages(self, pages, first_page_number: int, document_id: str, owner_id: str,
+                    conversation_id: str) -> List[List[ChunkRecord]]:
+        pass
+
+    def warm_up(self):
+        """Loads models or tokenizers before the first upload."""
+        pass
+
+    def start_process_pool(self):
+        """Starts the worker processes of the splitter, if it uses any. They are shut down with the app."""
         pass
@@ -1,28 +1,121 @@
+from collections import deque
 from typing import List
-from langchain_text_splitters import SpacyTextSplitter
-from tqdm import tqdm
-from app.core.domain.chunks.chunk_model import ChunkModel, ChunkMetadata
+
+from app.core.domain.chunks.chunk_exceptions import InvalidContentError
+from app.core.domain.chunks.chunk_model import ChunkRecord
+from app.core.domain.upload.sentence_splitter import SentenceSplitter, SplitterMode, TEXT_SPLITTER_MODE
+from app.core.domain.upload.token_chunker import TokenChunker
 from app.core.domain.upload.text_splitter_interface import TextSplitter
 from app.core.utils.logger import Logger
 
 logger = Logger('Logger')
 
+SENTENCE_SEPARATOR = "\n\n"
+
+
+def merge_splits(splits: List[str], separator: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """
+    Joins consecutive splits into chunks of at most chunk_size characters. The next chunk starts with the last
+    splits of the previous one, up to chunk_overlap characters. A split longer than chunk_size becomes its own chunk.
+    """
+    chunks = []
+    current: deque = deque()
+    total = 0
+    for split in splits:
+        if current and total + len(separator) + len(split) > chunk_size:
+            chunk = separator.join(current).strip()
+            if chunk:
+                chunks.append(chunk)
+            # Keep the tail of the chunk as overlap, as long as the next split still fits
+            while current and (total > chunk_overlap or total + len(separator) + len(split) > chunk_size):
+                total -= len(current.popleft()) + (len(separator) if current else 0)
+        total += len(split) + (len(separator) if current else 0)
+        current.append(split)
+
+    chunk = separator.join(current).strip()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
 
 class TextSplitterService(TextSplitter):
-    def __init__(self, chunk_size: int):
-        self.splitter = SpacyTextSplitter(chunk_size=chunk_size)
+    """
+    Splits pages into sentence based chunks. The sentence boundaries come from the SentenceSplitter of the mode
+    (TEXT_SPLITTER_MODE), which keeps its spaCy pipeline loaded between uploads. In token mode the chunks are
+    bounded in tokens by the TokenChunker and chunk_size is not used. The service holds no per upload state, so one
+    instance can be shared.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 200, mode: SplitterMode = TEXT_SPLITTER_MODE):
+        self.mode = mode
+        if mode == "token":
+            self.token_chunker = TokenChunker()
+        else:
+            if chunk_overlap > chunk_size:
+                raise ValueError(f"The chunk overlap ({chunk_overlap}) is larger than the chunk size ({chunk_size})")
+            self.sentence_splitter = SentenceSplitter(mode=mode)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def warm_up(self):
+        if self.mode == "token":
+            self.token_chunker.warm_up()
+        else:
+            self.sentence_splitter.warm_up()
+
+    def start_process_pool(self):
+        if self.mode != "token":
+            self.sentence_splitter.start_process_pool()
 
     @logger.log_decorator(level="debug", message="Creating chunks")
-    def split_text(self, text, document_id: str, owner_id: str, conversation_id: str) -> List[ChunkModel]:
+    def split_text(self, text, document_id: str, owner_id: str, conversation_id: str) -> List[ChunkRecord]:
+        page_chunks = self.split_pages(pages=text,
+                                       first_page_number=1,
+                                       document_id=document_id,
+                                       owner_id=owner_id,
+                                       conversation_id=conversation_id)
+        return [chunk for chunks in page_chunks for chunk in chunks]
+
+    def split_page(self, page, page_number: int, document_id: str, owner_id: str,
+                   conversation_id: str) -> List[ChunkRecord]:
+        return self.split_pages(pages=[page],
+                                first_page_number=page_number,
+                                document_id=document_id,
+                                owner_id=owner_id,
+                                conversation_id=conversation_id)[0]
+
+    def split_pages(self, pages, first_page_number: int, document_id: str, owner_id: str,
+                    conversation_id: str) -> List[List[ChunkRecord]]:
+        texts = [page.page_content for page in pages]
+        if self.mode == "token":
+            chunks_per_page = [self.token_chunker.split(text) for text in texts]
+        else:
+            # The sentences are merged into chunks of at most chunk_size characters, like the SpacyTextSplitter
+            chunks_per_page = [merge_splits(sentences, SENTENCE_SEPARATOR, self.chunk_size, self.chunk_overlap)
+                               for sentences in self.sentence_splitter.sentences_batch(texts)]
+        return [self._to_chunks(page_chunks,
+                                page_number=page_number,
+                                document_id=document_id,
+                                owner_id=owner_id,
+                                conversation_id=conversation_id)
+                for page_number, page_chunks in enumerate(chunks_per_page, start=first_page_number)]
+
+    @staticmethod
+    def _to_chunks(page_chunks: List[str], page_number: int, document_id: str, owner_id: str,
+                   conversation_id: str) -> List[ChunkRecord]:
         chunks = []
-        for page_number, page in enumerate(text, start=1):
-            page_chunks = self.splitter.split_text(page.page_content)
-            for on_page_index, chunk in tqdm(enumerate(page_chunks, start=1), total=len(page_chunks)):
-                metadata = ChunkMetadata(document_id=document_id,
-                                         owner_id=owner_id,
-                                         conversation_id=conversation_id,
-                                         page_number=page_number,
-                                         on_page_index=on_page_index)
-                chunk_obj = ChunkModel(content=chunk, metadata=metadata)
-                chunks.append(chunk_obj)
+        for chunk in page_chunks:
+            try:
+                chunk_obj = ChunkRecord.create(content=chunk,
+                                               document_id=document_id,
+                                               owner_id=owner_id,
+                                               conversation_id=conversation_id,
+                                               page_number=page_number,
+                                               on_page_index=len(chunks) + 1)
+            except InvalidContentError as e:
+                # A fragment that is too short or too long is skipped instead of failing the upload
+                logger.log(level="warning", func_name="TextSplitterService",
+                           message=f"Skipped a chunk of {len(chunk)} characters on page {page_number}: {e}")
+                continue
+            chunks.append(chunk_obj)
         return chunks
@@ -0,0 +1,109 @@
+import os
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+from dotenv import load_dotenv
+
+from app.core.domain.upload.sentence_splitter import REGEX_SENTENCE_BOUNDARY
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+TEXT_SPLITTER_MAX_TOKENS = int(os.getenv("TEXT_SPLITTER_MAX_TOKENS", 256))
+# Smallest chunk, only pages with less text give smaller chunks
+TEXT_SPLITTER_MIN_TOKENS = int(os.getenv("TEXT_SPLITTER_MIN_TOKENS", 64))
+TEXT_SPLITTER_OVERLAP_TOKENS = int(os.getenv("TEXT_SPLITTER_OVERLAP_TOKENS", 32))
+
+
+@lru_cache(maxsize=None)
+def embedding_tokenizer(model_name: str = EMBEDDING_MODEL):
+    """tiktoken encoding of the embedding model, cl100k_base for unknown models."""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except (KeyError, TypeError):
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenChunker:
+    """
+    Splits a page into chunks of min_tokens to max_tokens tokens of the embedding model, with overlap_tokens tokens
+    shared by neighbouring chunks. The page is encoded once. Chunks end at the last sentence boundary that fits and
+    are cut inside a sentence only if it is longer than a chunk. The chunk texts are slices of the page text, so no
+    chunk is encoded or decoded again. Pages shorter than min_tokens become a single chunk.
+    """
+
+    def __init__(self,
+                 max_tokens: int = TEXT_SPLITTER_MAX_TOKENS,
+                 min_tokens: int = TEXT_SPLITTER_MIN_TOKENS,
+                 overlap_tokens: int = TEXT_SPLITTER_OVERLAP_TOKENS,
+                 model_name: str = EMBEDDING_MODEL,
+                 tokenizer=None):
+        if not 0 <= overlap_tokens < min_tokens <= max_tokens:
+            raise ValueError("The token bounds must satisfy 0 <= overlap < min <= max")
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.overlap_tokens = overlap_tokens
+        self.model_name = model_name
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = embedding_tokenizer(self.model_name)
+        return self._tokenizer
+
+    def warm_up(self):
+        _ = self.tokenizer
+
+    def split(self, text: str) -> List[str]:
+        tokens = self.tokenizer.encode_ordinary(text)
+        if not tokens:
+            return []
+        _, offsets = self.tokenizer.decode_with_offsets(tokens)
+        # Character offset of every token and of the end of the text
+        offsets = list(offsets) + [len(text)]
+        boundaries = self._sentence_boundaries(text, offsets)
+
+        chunks = []
+        total = len(tokens)
+        start = 0
+        while True:
+            end = self._chunk_end(start, total, boundaries)
+            chunk = text[offsets[start]:offsets[end]].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= total:
+                return chunks
+            start = self._next_start(start, end, boundaries)
+
+    def _sentence_boundaries(self, text: str, offsets: List[int]) -> List[int]:
+        """Token indexes at which a sentence starts, in ascending order."""
+        boundaries = []
+        for match in REGEX_SENTENCE_BOUNDARY.finditer(text):
+            # The whitespace after the punctuation belongs to the first token of the next sentence
+            index = bisect_left(offsets, match.start())
+            if not boundaries or boundaries[-1] != index:
+                boundaries.append(index)
+        return boundaries
+
+    def _chunk_end(self, start: int, total: int, boundaries: List[int]) -> int:
+        if total - start <= self.max_tokens:
+            return total
+        limit = start + self.max_tokens
+        # Leave at least min_tokens for the last chunk of the page, instead of a tiny tail
+        limit = min(limit, total - self.min_tokens)
+        # Last sentence boundary that gives a chunk of at least min_tokens
+        position = bisect_right(boundaries, limit) - 1
+        if position >= 0 and boundaries[position] >= start + self.min_tokens:
+            return boundaries[position]
+        return max(limit, start + self.min_tokens)
+
+    def _next_start(self, start: int, end: int, boundaries: List[int]) -> int:
+        overlap_start = end - self.overlap_tokens
+        # Start the overlap at a sentence boundary if one lies inside it
+        position = bisect_left(boundaries, overlap_start)
+        if position < len(boundaries) and boundaries[position] < end:
+            overlap_start = boundaries[position]
+        return max(overlap_start, start + 1)
@@ -0,0 +1,38 @@
+"""
+Adds the payload indexes of PAYLOAD_INDEXES to existing collections. Indexes that already exist are skipped, so the
+migration can be run repeatedly.
+
+Usage: python -m app.core.external_services.database.vector_store.migrate_payload_indexes [collection_name ...]
+
+Without arguments, the default collection (VECTOR_STORE_COLLECTION) is migrated.
+"""
+import argparse
+import asyncio
+
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import COLLECTION_NAME, VectorStoreQdrant
+from app.core.utils.logger import Logger
+
+logger = Logger('Logger')
+
+
+def migrate(vector_store: VectorStoreQdrant, collection_names: list[str]):
+    for collection_name in collection_names:
+        created_indexes = vector_store.create_payload_indexes(collection_name)
+        logger.log(level="info", func_name="migrate_payload_indexes",
+                   message=f"Collection '{collection_name}': created indexes {created_indexes or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the payload indexes to existing collections.")
+    parser.add_argument("collection_names", nargs="*", default=[COLLECTION_NAME])
+    args = parser.parse_args()
+
+    vector_store = VectorStoreQdrant()
+    try:
+        migrate(vector_store, args.collection_names)
+    finally:
+        asyncio.run(vector_store.close())
+
+
+if __name__ == "__main__":
+    main()
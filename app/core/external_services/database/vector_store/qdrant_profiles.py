@@ -0,0 +1,82 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+from qdrant_client import models
+
+
+class CollectionProfile(BaseModel):
+    """Storage, index and search settings of a collection, tuned for one trade-off between latency and memory."""
+    name: str
+    description: str
+    on_disk_vectors: bool
+    hnsw_config: models.HnswConfigDiff
+    optimizers_config: Optional[models.OptimizersConfigDiff] = None
+    quantization_config: Optional[models.QuantizationConfig] = None
+    search_params: models.SearchParams
+
+
+COLLECTION_PROFILES: Dict[str, CollectionProfile] = {
+    profile.name: profile for profile in [
+        CollectionProfile(
+            name="low-latency",
+            description="Vectors and graph in RAM, int8 quantization with rescoring and a low search-time ef.",
+            on_disk_vectors=False,
+            hnsw_config=models.HnswConfigDiff(m=32, ef_construct=256, on_disk=False),
+            optimizers_config=models.OptimizersConfigDiff(default_segment_number=4),
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+            ),
+            search_params=models.SearchParams(
+                hnsw_ef=64,
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=1.5),
+            ),
+        ),
+        CollectionProfile(
+            name="balanced",
+            description="Original vectors on disk, graph and int8 quantized vectors in RAM.",
+            on_disk_vectors=True,
+            hnsw_config=models.HnswConfigDiff(m=16, ef_construct=128, on_disk=False),
+            optimizers_config=models.OptimizersConfigDiff(default_segment_number=2),
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+            ),
+            search_params=models.SearchParams(
+                hnsw_ef=128,
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0),
+            ),
+        ),
+        CollectionProfile(
+            name="memory-lean",
+            description="Vectors and graph on disk, only binary quantized vectors in RAM. Rescoring reads from disk.",
+            on_disk_vectors=True,
+            hnsw_config=models.HnswConfigDiff(m=16, ef_construct=100, on_disk=True),
+            optimizers_config=models.OptimizersConfigDiff(memmap_threshold=20000),
+            quantization_config=models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            ),
+            search_params=models.SearchParams(
+                hnsw_ef=128,
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=3.0),
+            ),
+        ),
+    ]
+}
+
+
+def profile_of_collection(config: models.CollectionConfig) -> Optional[CollectionProfile]:
+    """The profile a collection was created with, recognized by its index and storage settings."""
+    vectors = config.params.vectors
+    for profile in COLLECTION_PROFILES.values():
+        if (config.hnsw_config.m == profile.hnsw_config.m
+                and config.hnsw_config.ef_construct == profile.hnsw_config.ef_construct
+                and bool(config.hnsw_config.on_disk) == bool(profile.hnsw_config.on_disk)
+                and bool(getattr(vectors, "on_disk", False)) == profile.on_disk_vectors
+                and type(config.quantization_config) is type(profile.quantization_config)):
+            return profile
+    return None
+
+
+def get_collection_profile(name: str) -> CollectionProfile:
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile '{name}'. Available profiles: {', '.join(COLLECTION_PROFILES)}")
+    return COLLECTION_PROFILES[name]
@@ -1,11 +1,15 @@
 import os
 
+import httpx
 from dotenv import load_dotenv
 from langchain_qdrant import Qdrant
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from qdrant_client.http.models import CollectionInfo
 
+from app.core.external_services.database.vector_store.qdrant_profiles import CollectionProfile, \
+    get_collection_profile, profile_of_collection
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
+from app.core.external_services.embedding.openai_embedding_adapter import embedding_dimensions
 from app.core.external_services.database.vector_store.vector_store_port import VectorStore
 from app.core.utils.logger import Logger
 
@@ -15,35 +19,130 @@ load_dotenv()
 
 COLLECTION_NAME = os.getenv("VECTOR_STORE_COLLECTION")
 MAX_K_RESULTS = os.getenv("MAX_K_RESULTS")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_DIMENSIONS = os.getenv("EMBEDDING_DIMENSIONS")
+# Tuning profile of new collections, see qdrant_profiles.py
+VECTOR_STORE_PROFILE = os.getenv("VECTOR_STORE_PROFILE", "balanced")
+
+# Connection pool settings shared by the sync and the async client
+VECTOR_STORE_PREFER_GRPC = os.getenv("VECTOR_STORE_PREFER_GRPC", "false").lower() == "true"
+VECTOR_STORE_GRPC_PORT = int(os.getenv("VECTOR_STORE_GRPC_PORT", 6334))
+VECTOR_STORE_TIMEOUT = int(os.getenv("VECTOR_STORE_TIMEOUT", 30))
+VECTOR_STORE_POOL_SIZE = int(os.getenv("VECTOR_STORE_POOL_SIZE", 100))
+VECTOR_STORE_KEEPALIVE_CONNECTIONS = int(os.getenv("VECTOR_STORE_KEEPALIVE_CONNECTIONS", 20))
+VECTOR_STORE_KEEPALIVE_EXPIRY = float(os.getenv("VECTOR_STORE_KEEPALIVE_EXPIRY", 30))
+
+# Sparse BM25 vector of the chunk text, stored next to the unnamed dense vector for hybrid search
+SPARSE_VECTOR_NAME = "text-sparse"
+
+# Keyword indexes on the fields every query filters on. The owner is the tenant of a chunk, so its index is
+# tenant-optimized and Qdrant co-locates the points of one owner.
+PAYLOAD_INDEXES = {
+    "metadata.owner_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+    "metadata.document_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+    "metadata.conversation_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+}
 
 
 class VectorStoreQdrant(VectorStore):
-
-    def __init__(self):
-        self.collection_connection: Qdrant | None = None
-        self.client = QdrantClient(url=os.getenv("VECTOR_STORE_URL"))
-
-        # Initialize the collection if it does not exist
+    """
+    Process-wide Qdrant vector store. One instance is created in the application lifespan and shared by all
+    requests, so the HTTP (or gRPC) connections of the sync and the async client are pooled and reused.
+    """
+
+    def __init__(self,
+                 url: str = os.getenv("VECTOR_STORE_URL"),
+                 prefer_grpc: bool = VECTOR_STORE_PREFER_GRPC,
+                 grpc_port: int = VECTOR_STORE_GRPC_PORT,
+                 timeout: int = VECTOR_STORE_TIMEOUT,
+                 pool_size: int = VECTOR_STORE_POOL_SIZE,
+                 keepalive_connections: int = VECTOR_STORE_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = VECTOR_STORE_KEEPALIVE_EXPIRY,
+                 profile: str = VECTOR_STORE_PROFILE):
+        self.profile: CollectionProfile = get_collection_profile(profile)
+        client_options = {
+            "url": url,
+            "prefer_grpc": prefer_grpc,
+            "grpc_port": grpc_port,
+            "timeout": timeout,
+            # Used by the REST transport
+            "limits": httpx.Limits(max_connections=pool_size,
+                                   max_keepalive_connections=keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry),
+            # Used by the gRPC transport
+            "grpc_options": {
+                "grpc.keepalive_time_ms": int(keepalive_expiry * 1000),
+                "grpc.keepalive_permit_without_calls": 1,
+            },
+        }
+
+        self.client = QdrantClient(**client_options)
+        self.async_client = AsyncQdrantClient(**client_options)
+        self._sparse_vector_support: dict[str, bool] = {}
+        self._collection_profiles: dict[str, CollectionProfile] = {}
+
+    @logger.log_decorator(level="debug", message="Initialize vector store")
+    def startup(self):
+        """Checks the default collection once and creates it if it does not exist."""
         if self.collection_exists(COLLECTION_NAME) is False:
             logger.log(level="warning", message="Creating collection")
             self.create_collection(collection_name=COLLECTION_NAME)
+        self.supports_sparse_vectors(COLLECTION_NAME)
+        self.get_profile(COLLECTION_NAME)
+
+    @logger.log_decorator(level="debug", message="Close vector store")
+    async def close(self):
+        """Closes the pooled connections of both clients."""
+        self.client.close()
+        await self.async_client.close()
 
     def get_client(self) -> QdrantClient:
         return self.client
 
+    def get_async_client(self) -> AsyncQdrantClient:
+        return self.async_client
+
     def collection_exists(self, collection_name: str) -> bool:
         return self.client.collection_exists(collection_name=collection_name)
 
-    def get_connection(self, embedding_model: EmbeddingModel) -> Qdrant:
-        if self.collection_connection is None:
-            self.collection_connection = Qdrant(client=self.client,
-                                                collection_name=COLLECTION_NAME,
-                                                embeddings=embedding_model.get_model(),
-                                                metadata_payload_key="metadata",
-                                                )
-
-        return self.collection_connection
+    def supports_sparse_vectors(self, collection_name: str | None = None) -> bool:
+        """Collections created before hybrid search have no sparse vector, their chunks are stored dense only."""
+        collection_name = collection_name or COLLECTION_NAME
+        if collection_name not in self._sparse_vector_support:
+            sparse_vectors = self.client.get_collection(collection_name=collection_name).config.params.sparse_vectors
+            self._sparse_vector_support[collection_name] = SPARSE_VECTOR_NAME in (sparse_vectors or {})
+        return self._sparse_vector_support[collection_name]
+
+    def get_profile(self, collection_name: str | None = None) -> CollectionProfile:
+        """
+        Profile of the collection. Collections that were not created by this process are matched to a profile by
+        their settings, collections with settings of no profile use the profile of the store.
+        """
+        collection_name = collection_name or COLLECTION_NAME
+        if collection_name not in self._collection_profiles:
+            config = self.client.get_collection(collection_name=collection_name).config
+            profile = profile_of_collection(config)
+            if profile is None:
+                logger.log(level="warning", func_name="VectorStoreQdrant.get_profile",
+                           message=f"Collection {collection_name} matches no profile, "
+                                   f"searching it with the {self.profile.name} profile")
+                profile = self.profile
+            self._collection_profiles[collection_name] = profile
+        return self._collection_profiles[collection_name]
+
+    def get_search_params(self, collection_name: str | None = None) -> models.SearchParams:
+        """Search-time parameters (hnsw_ef, quantization rescoring) of the profile of the collection."""
+        return self.get_profile(collection_name).search_params
 
+    def get_connection(self, embedding_model: EmbeddingModel) -> Qdrant:
+        # The connection only wraps the shared clients, but it is bound to the embedding model of the request
+        # (and therefore to its api key). That's why it must not be cached on the shared vector store.
+        return Qdrant(client=self.client,
+                      async_client=self.async_client,
+                      collection_name=COLLECTION_NAME,
+                      embeddings=embedding_model.get_model(),
+                      metadata_payload_key="metadata",
+                      )
 
     def get_collection(self, collection_name: str) -> CollectionInfo | None:
         if self.client.collection_exists(collection_name=collection_name):
@@ -54,14 +153,46 @@ class VectorStoreQdrant(VectorStore):
         return self.client.get_collections()
 
     @logger.log_decorator(level="debug", message="Create new collection")
-    def create_collection(self, collection_name: str):
+    def create_collection(self, collection_name: str, profile: str | None = None, vector_size: int | None = None):
+        collection_profile = get_collection_profile(profile) if profile else self.profile
+        # The vector size must match the dimensions of the configured embedding model
+        vector_size = vector_size or embedding_dimensions(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
         if not self.collection_exists(collection_name):
             self.client.create_collection(
                 collection_name=collection_name,
-                vectors_config=models.VectorParams(size=1536, distance=models.Distance.COSINE, on_disk=True),
-                hnsw_config=models.HnswConfigDiff(m=64, ef_construct=512, on_disk=True),
+                vectors_config=models.VectorParams(size=vector_size,
+                                                   distance=models.Distance.COSINE,
+                                                   on_disk=collection_profile.on_disk_vectors),
+                sparse_vectors_config={
+                    SPARSE_VECTOR_NAME: models.SparseVectorParams(
+                        index=models.SparseIndexParams(on_disk=collection_profile.on_disk_vectors),
+                        modifier=models.Modifier.IDF,
+                    )
+                },
+                hnsw_config=collection_profile.hnsw_config,
+                optimizers_config=collection_profile.optimizers_config,
+                quantization_config=collection_profile.quantization_config,
             )
+            self.create_payload_indexes(collection_name)
+            self._collection_profiles[collection_name] = collection_profile
+
+    @logger.log_decorator(level="debug", message="Create payload indexes")
+    def create_payload_indexes(self, collection_name: str) -> list[str]:
+        """Creates the payload indexes that are missing in the collection and returns their field names."""
+        existing_indexes = self.client.get_collection(collection_name=collection_name).payload_schema
+        created_indexes = []
+
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            if field_name not in existing_indexes:
+                self.client.create_payload_index(collection_name=collection_name,
+                                                 field_name=field_name,
+                                                 field_schema=field_schema)
+                created_indexes.append(field_name)
+
+        return created_indexes
 
     @logger.log_decorator(level="debug", message="Delete collection")
     def delete_collection(self, collection_name: str):
         self.client.delete_collection(collection_name=collection_name)
+        self._sparse_vector_support.pop(collection_name, None)
+        self._collection_profiles.pop(collection_name, None)
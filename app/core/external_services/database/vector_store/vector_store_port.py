@@ -12,6 +12,10 @@ class VectorStore(ABC):
     def get_client(self) -> Any:
         pass
 
+    @abstractmethod
+    def get_async_client(self) -> Any:
+        pass
+
     @abstractmethod
     def get_connection(self, embedding_model: EmbeddingModel) -> Any:
         pass
@@ -21,7 +25,19 @@ class VectorStore(ABC):
         pass
 
     @abstractmethod
-    def create_collection(self, collection_name: str):
+    def get_search_params(self, collection_name: str | None = None) -> Any:
+        pass
+
+    @abstractmethod
+    def supports_sparse_vectors(self, collection_name: str | None = None) -> bool:
+        pass
+
+    @abstractmethod
+    def create_collection(self, collection_name: str, profile: str | None = None, vector_size: int | None = None):
+        pass
+
+    @abstractmethod
+    def create_payload_indexes(self, collection_name: str) -> list[str]:
         pass
 
     @abstractmethod
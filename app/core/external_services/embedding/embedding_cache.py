@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from app.core.utils.logger import Logger
+from app.core.utils.singleton import SingletonMeta
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 4096))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def make_cache_key(model_name: str, dimensions, text: str) -> str:
+    """Content address of an embedding: the model, its dimensions and the whitespace-normalized text."""
+    normalized_text = " ".join(text.split())
+    return hashlib.sha256(f"{model_name}\x00{dimensions}\x00{normalized_text}".encode()).hexdigest()
+
+
+class EmbeddingCache(metaclass=SingletonMeta):
+    """
+    Process-wide, content-addressed embedding cache with two tiers: an in-process LRU and a SQLite file that is
+    evicted by last access once it grows beyond EMBEDDING_CACHE_MAX_BYTES. Vectors are stored as float32.
+    """
+
+    def __init__(self,
+                 path: str = EMBEDDING_CACHE_PATH,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, array] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                         "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+        # The file is shared by all worker processes, so its size is kept in the file itself by triggers
+        self._db.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS embeddings_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+            INSERT OR IGNORE INTO embeddings_size SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings;
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings BEGIN
+                UPDATE embeddings_size SET bytes = bytes + LENGTH(NEW.vector);
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF vector ON embeddings BEGIN
+                UPDATE embeddings_size SET bytes = bytes + LENGTH(NEW.vector) - LENGTH(OLD.vector);
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings BEGIN
+                UPDATE embeddings_size SET bytes = bytes - LENGTH(OLD.vector);
+            END;
+            COMMIT;
+        """)
+        self._disk_bytes = self._read_disk_bytes()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Returns the cached vectors of the given keys. Keys that are not cached are missing in the result."""
+        found: Dict[str, array] = {}
+        with self._lock:
+            disk_keys = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    disk_keys.append(key)
+
+            # Stay below the SQLite limit of bound parameters per statement
+            for start in range(0, len(disk_keys), 500):
+                batch = disk_keys[start:start + 500]
+                for key, blob in self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch):
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+
+            if disk_keys:
+                disk_hits = [key for key in disk_keys if key in found]
+                self.misses += len(disk_keys) - len(disk_hits)
+                if disk_hits:
+                    now = time.time()
+                    self._db.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                                         [(now, key) for key in disk_hits])
+                    self._db.commit()
+
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            rows = []
+            for key, vector in vectors.items():
+                vector = array("f", vector)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+
+            # An upsert instead of INSERT OR REPLACE, whose implicit delete does not fire the size trigger
+            self._db.executemany("INSERT INTO embeddings (key, vector, accessed_at) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (key) DO UPDATE SET vector = excluded.vector, "
+                                 "accessed_at = excluded.accessed_at", rows)
+            self._disk_bytes = self._read_disk_bytes()
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _remember(self, key: str, vector: array):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        # Delete the least recently used rows until the file is back at 90 % of its budget
+        target = self.max_bytes * 0.9
+        for key, size in self._db.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY accessed_at").fetchall():
+            if self._disk_bytes <= target:
+                break
+            self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._disk_bytes -= size
+        self._disk_bytes = self._read_disk_bytes()
+
+    def _read_disk_bytes(self) -> int:
+        return self._db.execute("SELECT bytes FROM embeddings_size").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that consult the EmbeddingCache before the wrapped model is called for the missing texts."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str, dimensions):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = self._keys(texts)
+        cached = self.cache.get_many(keys)
+        missing = self._missing(texts, keys, cached)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(missing, vectors, cached)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = self._keys(texts)
+        cached = await asyncio.to_thread(self.cache.get_many, keys)
+        missing = self._missing(texts, keys, cached)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._store, missing, vectors, cached)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def _keys(self, texts: List[str]) -> List[str]:
+        return [make_cache_key(self.model_name, self.dimensions, text) for text in texts]
+
+    def _missing(self, texts: List[str], keys: List[str], cached: Dict[str, List[float]]) -> Dict[str, str]:
+        # Duplicates within the same call are only embedded once
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        logger.log(level="debug", func_name="CachedEmbeddings",
+                   message=f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} texts cached. "
+                           f"Stats: {self.cache.stats()}")
+        return missing
+
+    def _store(self, missing: Dict[str, str], vectors: List[List[float]], cached: Dict[str, List[float]]):
+        new_vectors = dict(zip(missing.keys(), vectors))
+        self.cache.put_many(new_vectors)
+        cached.update(new_vectors)
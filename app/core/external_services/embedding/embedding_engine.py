@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, List, Tuple
+
+import openai
+from dotenv import load_dotenv
+
+from app.core.external_services.embedding.embedding_port import EmbeddingModel
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 50000))
+EMBEDDING_BATCH_MAX_TEXTS = int(os.getenv("EMBEDDING_BATCH_MAX_TEXTS", 512))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", 1.0))
+# Api keys whose rate limiter is kept, the least recently used ones are dropped
+EMBEDDING_RATE_LIMITERS_MAX = int(os.getenv("EMBEDDING_RATE_LIMITERS_MAX", 1024))
+
+# Errors after which the same batch is sent again
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class EmbeddingRateLimiter:
+    """
+    Limits the concurrent embedding requests and the tokens sent per minute for one api key. The token budget is a
+    token bucket that refills continuously.
+    """
+
+    def __init__(self, concurrency: int = EMBEDDING_CONCURRENCY,
+                 tokens_per_minute: int = EMBEDDING_TOKENS_PER_MINUTE):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self._available_tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire_tokens(self, tokens: int):
+        # A single batch can never wait for more than a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._available_tokens = min(
+                    self.tokens_per_minute,
+                    self._available_tokens + (now - self._updated_at) * self.tokens_per_minute / 60
+                )
+                self._updated_at = now
+
+                if self._available_tokens >= tokens:
+                    self._available_tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._available_tokens) * 60 / self.tokens_per_minute)
+
+
+_rate_limiters: OrderedDict[str, EmbeddingRateLimiter] = OrderedDict()
+
+
+def get_rate_limiter(api_key: str) -> EmbeddingRateLimiter:
+    """Returns the process-wide rate limiter of an api key, so concurrent requests share one budget."""
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    if key in _rate_limiters:
+        _rate_limiters.move_to_end(key)
+    else:
+        _rate_limiters[key] = EmbeddingRateLimiter()
+        # A dropped api key starts again with a full budget when it returns
+        while len(_rate_limiters) > EMBEDDING_RATE_LIMITERS_MAX:
+            _rate_limiters.popitem(last=False)
+    return _rate_limiters[key]
+
+
+class EmbeddingEngine:
+    """
+    Embeds texts in batches that are packed by token budget. Several batches are in flight at once, limited by the
+    concurrency and tokens-per-minute budget of the api key, and failed batches are retried with exponential backoff.
+    """
+
+    def __init__(self,
+                 embedding_model: EmbeddingModel,
+                 max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                 max_batch_texts: int = EMBEDDING_BATCH_MAX_TEXTS,
+                 max_retries: int = EMBEDDING_MAX_RETRIES,
+                 retry_base_delay: float = EMBEDDING_RETRY_BASE_DELAY,
+                 rate_limiter: EmbeddingRateLimiter | None = None):
+        self.embedding_model = embedding_model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_texts = max_batch_texts
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.rate_limiter = rate_limiter or get_rate_limiter(embedding_model.api_key)
+
+    def make_batches(self, texts: List[str]) -> List[Tuple[int, int, int]]:
+        """Splits the texts into contiguous batches. Returns (start, stop, tokens) for each batch."""
+        batches = []
+        start, batch_tokens = 0, 0
+
+        for index, text in enumerate(texts):
+            tokens = self.embedding_model.estimate_tokens_text(text)
+            is_full = index - start >= self.max_batch_texts or batch_tokens + tokens > self.max_batch_tokens
+            if index > start and is_full:
+                batches.append((start, index, batch_tokens))
+                start, batch_tokens = index, 0
+            batch_tokens += tokens
+
+        if start < len(texts):
+            batches.append((start, len(texts), batch_tokens))
+        return batches
+
+    async def embed_batches(self, texts: List[str],
+                            return_exceptions: bool = False) -> AsyncIterator[Tuple[int, int, List[List[float]]]]:
+        """
+        Yields (start, stop, vectors) for every batch as soon as it is embedded, not necessarily in order. With
+        return_exceptions, a batch that failed after all retries yields its exception instead of the vectors.
+        At most as many batches as the concurrency of the rate limiter are embedded ahead of the consumer, so the
+        memory does not grow with the number of texts.
+        """
+
+        async def embed(start: int, stop: int, tokens: int):
+            try:
+                return start, stop, await self._embed_batch(texts[start:stop], tokens)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return start, stop, e
+
+        batches = iter(self.make_batches(texts))
+        pending = set()
+        try:
+            while True:
+                for batch in itertools.islice(batches, self.rate_limiter.concurrency - len(pending)):
+                    pending.add(asyncio.create_task(embed(*batch)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns the vectors of all texts in input order."""
+        vectors: List[List[float]] = [[] for _ in texts]
+        async for start, stop, batch_vectors in self.embed_batches(texts):
+            vectors[start:stop] = batch_vectors
+        return vectors
+
+    async def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            async with self.rate_limiter.semaphore:
+                await self.rate_limiter.acquire_tokens(tokens)
+                try:
+                    return await self.embedding_model.get_model().aembed_documents(texts)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    error = e
+
+            # Back off outside of the semaphore, so other batches can use the slot
+            delay = self.retry_base_delay * 2 ** attempt * (1 + random.random())
+            logger.log(level="warning", func_name="EmbeddingEngine._embed_batch",
+                       message=f"Embedding batch failed ({error}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
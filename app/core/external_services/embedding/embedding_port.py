@@ -5,7 +5,7 @@ from typing import List, Any
 from dotenv import load_dotenv
 from pydantic import PositiveInt, Field
 
-from app.core.domain.chunks.chunk_model import ChunkModel
+from app.core.domain.chunks.chunk_model import ChunkLike
 
 load_dotenv()
 
@@ -43,5 +43,5 @@ class EmbeddingModel(ABC):
         pass
 
     @abstractmethod
-    def estimate_tokens_chunks(self, chunks: List[ChunkModel]) -> int:
+    def estimate_tokens_chunks(self, chunks: List[ChunkLike]) -> int:
         pass
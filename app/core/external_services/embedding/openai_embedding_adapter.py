@@ -6,8 +6,10 @@ from dotenv import load_dotenv
 from langchain_openai.embeddings import OpenAIEmbeddings
 from pydantic import PositiveInt
 
+from app.core.external_services.embedding.embedding_cache import (CachedEmbeddings, EmbeddingCache,
+                                                                  EMBEDDING_CACHE_ENABLED)
 from app.core.external_services.embedding.embedding_port import EmbeddingModel
-from app.core.domain.chunks.chunk_model import ChunkModel
+from app.core.domain.chunks.chunk_model import ChunkLike
 from app.core.utils.logger import Logger
 
 logger = Logger('Logger')
@@ -16,35 +18,63 @@ load_dotenv()
 
 DEFAULT_MODEL = os.getenv("EMBEDDING_MODEL")
 DEFAULT_DIMENSIONS = os.getenv("VECTOR_STORE_DIMENSION")
+# Allows to point the model to another OpenAI compatible server, e.g. a local fake server for tests
+DEFAULT_BASE_URL = os.getenv("EMBEDDING_API_BASE")
+
+# Length of the vectors of the OpenAI embedding models when no dimensions are requested
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def embedding_dimensions(model_name: str = DEFAULT_MODEL, dimensions: PositiveInt | None = None) -> int:
+    """Length of the vectors the embedding model returns, which is the vector size of its collections."""
+    if dimensions:
+        return int(dimensions)
+    if model_name not in MODEL_DIMENSIONS:
+        raise ValueError(f"Unknown dimensions of the embedding model '{model_name}', set EMBEDDING_DIMENSIONS")
+    return MODEL_DIMENSIONS[model_name]
 
 
 class OpenAIEmbeddingModel(EmbeddingModel):
-    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL, dimensions: PositiveInt = DEFAULT_DIMENSIONS):
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL, dimensions: PositiveInt = DEFAULT_DIMENSIONS,
+                 base_url: str = DEFAULT_BASE_URL):
         self.api_key = api_key
         self.model_name: str = model_name
         self.dimensions: PositiveInt = dimensions
         self.model = OpenAIEmbeddings(
             model=self.model_name,
             openai_api_key=self.api_key,
+            openai_api_base=base_url,
             dimensions=self.dimensions,
-            show_progress_bar=True
+            # Failed batches are retried by the EmbeddingEngine, retries of the client would multiply its retries
+            max_retries=0
         )
         self.tokenizer = tiktoken.get_encoding('cl100k_base')  # Example for the `gpt-3.5-turbo` model
 
     def get_model(self):
-        return self.model
+        if not EMBEDDING_CACHE_ENABLED:
+            return self.model
+        return CachedEmbeddings(embeddings=self.model,
+                                cache=EmbeddingCache(),
+                                model_name=self.model_name,
+                                dimensions=self.dimensions)
 
     def set_model(self, model_name: str):
+        self.model_name = model_name
         self.model.model = model_name
 
     def set_dimensions(self, dimensions: PositiveInt):
+        self.dimensions = dimensions
         self.model.dimensions = dimensions
 
     def estimate_tokens_text(self, text: str) -> int:
         tokens = self.tokenizer.encode(text)
         return len(tokens)
 
-    def estimate_tokens_chunks(self, chunks: List[ChunkModel]) -> int:
+    def estimate_tokens_chunks(self, chunks: List[ChunkLike]) -> int:
         return sum(self.estimate_tokens_text(chunk.content) for chunk in chunks)
 
 
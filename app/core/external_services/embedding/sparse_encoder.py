@@ -0,0 +1,59 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import List
+
+from dotenv import load_dotenv
+from qdrant_client import models
+
+load_dotenv()
+
+# BM25 term frequency saturation and length normalization. The IDF part is applied by Qdrant (Modifier.IDF).
+SPARSE_BM25_K1 = float(os.getenv("SPARSE_BM25_K1", 1.2))
+SPARSE_BM25_B = float(os.getenv("SPARSE_BM25_B", 0.75))
+# Average number of tokens of a chunk, used for the length normalization
+SPARSE_AVG_DOC_LENGTH = float(os.getenv("SPARSE_AVG_DOC_LENGTH", 80))
+
+# Words, numbers and identifiers such as part numbers ("ab-1234", "v2.1") are kept as one token
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def token_index(token: str) -> int:
+    """Stable index of a token in the hashed vocabulary, the same in every process."""
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "little")
+
+
+class BM25SparseEncoder:
+    """
+    Computes BM25 sparse vectors locally. Tokens are hashed into a 32 bit vocabulary, so no vocabulary has to be
+    fitted or stored. Documents get the saturated term frequencies as values, queries a weight of 1 per token, and
+    Qdrant multiplies them with the inverse document frequency of the collection.
+    """
+
+    def __init__(self, k1: float = SPARSE_BM25_K1, b: float = SPARSE_BM25_B,
+                 avg_doc_length: float = SPARSE_AVG_DOC_LENGTH):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(text.lower())
+
+    def encode_document(self, text: str) -> models.SparseVector:
+        tokens = self.tokenize(text)
+        length_norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_length)
+        weights = {}
+        for token, frequency in Counter(tokens).items():
+            # Hash collisions add up
+            index = token_index(token)
+            weights[index] = weights.get(index, 0.0) + frequency * (self.k1 + 1) / (frequency + length_norm)
+        return models.SparseVector(indices=list(weights), values=list(weights.values()))
+
+    def encode_documents(self, texts: List[str]) -> List[models.SparseVector]:
+        return [self.encode_document(text) for text in texts]
+
+    def encode_query(self, text: str) -> models.SparseVector:
+        indices = sorted({token_index(token) for token in self.tokenize(text)})
+        return models.SparseVector(indices=indices, values=[1.0] * len(indices))
@@ -1,3 +1,8 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field, validator
@@ -6,6 +11,12 @@ import os
 
 load_dotenv()
 
+# Chat clients are reused across requests, one per model, api key and sampling settings
+LLM_CLIENT_CACHE_SIZE = int(os.getenv("LLM_CLIENT_CACHE_SIZE", 256))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 100))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", 20))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
 print(os.getenv("LLM_MODEL"))
 print(os.getenv("LLM_DEFAULT_TEMP"))
 print(os.getenv("LLM_DEFAULT_TOKEN_LIMIT"))
@@ -13,6 +24,21 @@ print(os.getenv("LLM_MIN_TOKEN_LIMIT"))
 print(os.getenv("LLM_MAX_TOKEN_LIMIT"))
 
 
+_llm_clients: OrderedDict[tuple, ChatOpenAI] = OrderedDict()
+_llm_clients_lock = threading.Lock()
+_http_clients = {}
+
+
+def _get_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """HTTP connection pools shared by all chat clients, so connections to the api are kept alive across requests."""
+    with _llm_clients_lock:
+        if not _http_clients:
+            limits = httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS)
+            _http_clients["sync"] = httpx.Client(limits=limits, timeout=LLM_TIMEOUT)
+            _http_clients["async"] = httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+        return _http_clients["sync"], _http_clients["async"]
+
+
 class OpenAILLMModel(LlmModel):
 
     def __init__(self, api_key: str):
@@ -30,14 +56,29 @@ class OpenAILLMModel(LlmModel):
         return value
 
     def get_llm(self) -> ChatOpenAI:
-        return ChatOpenAI(
+        key = (self.model_name, hashlib.sha256(self.api_key.encode()).hexdigest(), self.temperature, self.max_tokens)
+        with _llm_clients_lock:
+            if key in _llm_clients:
+                _llm_clients.move_to_end(key)
+                return _llm_clients[key]
+
+        http_client, http_async_client = _get_http_clients()
+        llm = ChatOpenAI(
             model_name=self.model_name,
             openai_api_key=self.api_key,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client,
             verbose=True,
         )
 
+        with _llm_clients_lock:
+            _llm_clients[key] = llm
+            while len(_llm_clients) > LLM_CLIENT_CACHE_SIZE:
+                _llm_clients.popitem(last=False)
+        return llm
+
     def set_model(self, model_name: str) -> None:
         self.model_name = model_name
 
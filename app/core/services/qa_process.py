@@ -1,4 +1,11 @@
-from app.core.domain.qa.qa_chain_service import QAChainService
+import os
+from typing import AsyncIterator, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+
+from app.core.domain.qa.qa_answer_cache import QAAnswerCache, AnswerScope, QA_ANSWER_CACHE_ENABLED, answer_variant
+from app.core.domain.qa.qa_chain_factory import QAChainFactory, RetrieverType, qa_chain_config
 from app.core.domain.qa.qa_models import QALLMResponse
 from app.core.domain.qa.qa_prompts_interface import QAPromptsInterface
 from app.core.external_services.llm.llm_port import LlmModel
@@ -6,8 +13,13 @@ from app.core.domain.retriever.retriever import Retriever
 from app.models.objects.chat_history_model import ChatHistory
 from app.core.utils.logger import Logger
 
+load_dotenv()
+
 logger = Logger('Logger')
 
+# Retriever of the rag chain if the request does not choose one: mmr, similarity or hybrid
+QA_RETRIEVER_TYPE: RetrieverType = os.getenv("QA_RETRIEVER_TYPE", "mmr")
+
 
 class QAProcess:
     @staticmethod
@@ -20,23 +32,114 @@ class QAProcess:
             query: str,
             document_id: str,
             conversation_id: str,
-            chat_history: ChatHistory
+            chat_history: ChatHistory,
+            fetch_k: Optional[int] = None,
+            lambda_mult: Optional[float] = None,
+            retriever_type: Optional[RetrieverType] = None,
+            rerank: Optional[bool] = None
     ) -> QALLMResponse:
-        chains = QAChainService()
-        retriever_chain = chains.get_vector_store_retriever_chain(user_id=user_id,
-                                                                  document_id=document_id,
-                                                                  conversation_id=conversation_id,
-                                                                  llm=llm,
-                                                                  retriever=retriever,
-                                                                  prompt=prompts)
-        llm_chain = chains.get_llm_chain(llm=llm,
-                                         prompt=prompts)
-        rag_chain = chains.get_qa_chain(retriever_chain=retriever_chain,
-                                        llm_chain=llm_chain)
-        result = chains.run_qa_chain(rag_chain=rag_chain,
-                                     query=query,
-                                     chat_history=chat_history,
-                                     user_id=user_id
-                                     )
+        retriever_type = retriever_type or QA_RETRIEVER_TYPE
+        scope = (user_id, document_id, conversation_id)
+        variant = QAProcess._answer_variant(llm, chat_history, retriever_type, fetch_k, lambda_mult, rerank)
+        query_vector, cached_response = await QAProcess._get_cached_answer(retriever, query, scope, variant)
+        if cached_response is not None:
+            return cached_response
+
+        factory = QAChainFactory()
+        rag_chain = factory.get_rag_chain(prompts=prompts, retriever_type=retriever_type)
+        config = qa_chain_config(llm=llm,
+                                 retriever=retriever,
+                                 user_id=user_id,
+                                 document_id=document_id,
+                                 conversation_id=conversation_id,
+                                 fetch_k=fetch_k,
+                                 lambda_mult=lambda_mult,
+                                 rerank=rerank)
+        result = await factory.chains.run_qa_chain(rag_chain=rag_chain,
+                                                   query=query,
+                                                   chat_history=chat_history,
+                                                   config=config
+                                                   )
 
+        QAProcess._cache_answer(scope, variant, query_vector, result)
         return result
+
+    @staticmethod
+    @logger.log_decorator(level="debug", message="Starting streaming QA process")
+    async def stream_process(
+            llm: LlmModel,
+            retriever: Retriever,
+            prompts: QAPromptsInterface,
+            user_id: str,
+            query: str,
+            document_id: str,
+            conversation_id: str,
+            chat_history: ChatHistory,
+            fetch_k: Optional[int] = None,
+            lambda_mult: Optional[float] = None,
+            retriever_type: Optional[RetrieverType] = None,
+            rerank: Optional[bool] = None
+    ) -> AsyncIterator[Union[str, QALLMResponse]]:
+        """Yields the answer tokens as they arrive and finally the complete response."""
+        retriever_type = retriever_type or QA_RETRIEVER_TYPE
+        scope = (user_id, document_id, conversation_id)
+        variant = QAProcess._answer_variant(llm, chat_history, retriever_type, fetch_k, lambda_mult, rerank)
+        query_vector, cached_response = await QAProcess._get_cached_answer(retriever, query, scope, variant)
+        if cached_response is not None:
+            yield cached_response.answer
+            yield cached_response
+            return
+
+        factory = QAChainFactory()
+        rag_chain = factory.get_rag_chain(prompts=prompts, retriever_type=retriever_type)
+        config = qa_chain_config(llm=llm,
+                                 retriever=retriever,
+                                 user_id=user_id,
+                                 document_id=document_id,
+                                 conversation_id=conversation_id,
+                                 fetch_k=fetch_k,
+                                 lambda_mult=lambda_mult,
+                                 rerank=rerank)
+        async for event in factory.chains.stream_qa_chain(rag_chain=rag_chain,
+                                                          query=query,
+                                                          chat_history=chat_history,
+                                                          config=config):
+            if isinstance(event, QALLMResponse):
+                QAProcess._cache_answer(scope, variant, query_vector, event)
+            yield event
+
+    @staticmethod
+    def _answer_variant(llm: LlmModel, chat_history: ChatHistory, retriever_type: RetrieverType,
+                        fetch_k: Optional[int], lambda_mult: Optional[float], rerank: Optional[bool]) -> str:
+        # A follow-up question ("tell me more") depends on the history, so the history is part of the key
+        return answer_variant(history=chat_history.prefix_hashes()[-1],
+                              retriever_type=retriever_type,
+                              fetch_k=fetch_k,
+                              lambda_mult=lambda_mult,
+                              rerank=rerank,
+                              model=llm.model_name,
+                              temperature=llm.temperature,
+                              max_tokens=llm.max_tokens)
+
+    @staticmethod
+    async def _get_cached_answer(retriever: Retriever, query: str, scope: AnswerScope,
+                                 variant: str) -> Tuple[Optional[List[float]], Optional[QALLMResponse]]:
+        """Returns the query embedding and the cached answer of a similar question, if there is one."""
+        if not QA_ANSWER_CACHE_ENABLED:
+            return None, None
+
+        # The retriever embeds the same query, so its second embedding is served by the embedding cache
+        query_vector = await retriever.embedding_model.get_model().aembed_query(query)
+        cached_response = QAAnswerCache().get(scope, query_vector, variant)
+        if cached_response is not None:
+            logger.log(level="debug", func_name="QAProcess", message=f"Answer cache hit. "
+                                                                     f"Stats: {QAAnswerCache().stats()}")
+            cached_response.question = query
+        return query_vector, cached_response
+
+    @staticmethod
+    def _cache_answer(scope: AnswerScope, variant: str, query_vector: Optional[List[float]],
+                      response: QALLMResponse):
+        # Answers without related documents are not cached, the documents may still be uploaded
+        if query_vector is not None and response.related_documents:
+            QAAnswerCache().put(scope, query_vector, response, variant)
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from typing import List, Set
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app.core.domain.chunks.chunk_interface import AsyncChunkInterface
+from app.core.domain.chunks.chunk_repository import chunk_point_id
+from app.core.domain.chunks.chunk_model import ChunkRecord
+from app.core.domain.upload.pdf_reader_interface import PDFReader
+from app.core.domain.upload.text_splitter_interface import TextSplitter
+from app.core.external_services.embedding.embedding_engine import EMBEDDING_BATCH_MAX_TEXTS
+from app.core.external_services.embedding.embedding_port import EmbeddingModel
+from app.exceptions.http_exceptions import HTTPInternalServerError
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger(name="Logger")
+
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", 4))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 2))
+# Pages that are split together, large batches are split by several processes (see SentenceSplitter)
+UPLOAD_SPLIT_PAGES = int(os.getenv("UPLOAD_SPLIT_PAGES", 32))
+
+# Marks the end of a stage's output
+_END = None
+
+
+class UploadPipelineResult(BaseModel):
+    total_number_of_chunks: int = 0
+    total_number_of_tokens: int = 0
+
+
+class UploadPipeline:
+    """
+    Staged ingestion of a PDF. Pages stream from the pdf reader into the text splitter, the chunks are grouped into
+    batches and the batches are embedded and upserted by several workers. The stages run concurrently and are
+    connected by bounded queues, so only a few pages and batches are held in memory at any time. A batch holds as
+    many chunks as one embedding request, the repository and the embedding engine do the finer batching.
+
+    The chunks are upserted over the earlier upload of the document, whose points have the same ids where the
+    chunk positions match. Only once every batch was added are the remaining chunks of the earlier upload deleted.
+    If the upload fails, only the points written by it are deleted again, the rest of the earlier upload is kept.
+    """
+
+    def __init__(self,
+                 pdf_reader: PDFReader,
+                 text_splitter: TextSplitter,
+                 embedding_model: EmbeddingModel,
+                 chunk_repository: AsyncChunkInterface,
+                 batch_size: int = EMBEDDING_BATCH_MAX_TEXTS,
+                 queue_size: int = UPLOAD_QUEUE_SIZE,
+                 workers: int = UPLOAD_WORKERS,
+                 split_pages: int = UPLOAD_SPLIT_PAGES):
+        self.pdf_reader = pdf_reader
+        self.text_splitter = text_splitter
+        self.embedding_model = embedding_model
+        self.chunk_repository = chunk_repository
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.workers = workers
+        self.split_pages = split_pages
+
+    @logger.log_decorator(level="debug", message="Running upload pipeline")
+    async def run(self, file: bytes, document_id: str, owner_id: str, conversation_id: str) -> UploadPipelineResult:
+        result = UploadPipelineResult()
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        batches = asyncio.Queue(maxsize=self.queue_size)
+
+        # Ids of the points this upload has written
+        written_ids: Set[str] = set()
+
+        completed = False
+        try:
+            # If one stage fails, the task group cancels the others
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(self._read_pages(file, pages))
+                stages.create_task(self._split_pages(pages, batches, result,
+                                                     document_id=document_id,
+                                                     owner_id=owner_id,
+                                                     conversation_id=conversation_id))
+                for _ in range(self.workers):
+                    stages.create_task(self._add_batches(batches, written_ids))
+
+            # The point ids only depend on the chunk position, so an earlier upload with more chunks would
+            # otherwise keep its trailing chunks
+            await self.chunk_repository.delete_stale_chunks(user_id=owner_id, document_id=document_id,
+                                                            keep_ids=written_ids)
+            completed = True
+        except ExceptionGroup as e:
+            if len(e.exceptions) == 1:
+                raise e.exceptions[0]
+            raise HTTPInternalServerError(error="; ".join(str(error) for error in e.exceptions)) from e
+        finally:
+            if not completed and written_ids:
+                await asyncio.shield(self._rollback(document_id, owner_id, written_ids))
+
+        return result
+
+    async def _rollback(self, document_id: str, owner_id: str, written_ids: Set[str]):
+        """Deletes the chunks a failed upload has written, the error of the upload is raised either way."""
+        try:
+            await self.chunk_repository.delete_chunk_ids(user_id=owner_id, document_id=document_id,
+                                                         point_ids=written_ids)
+        except Exception as e:
+            logger.log(level="error", func_name="UploadPipeline.run",
+                       message=f"Could not delete the chunks of the failed upload of document {document_id}: {e}")
+
+    async def _read_pages(self, file: bytes, pages: asyncio.Queue):
+        async for page in self.pdf_reader.iter_pages(file):
+            await pages.put(page)
+        await pages.put(_END)
+
+    async def _split_pages(self, pages: asyncio.Queue, batches: asyncio.Queue, result: UploadPipelineResult,
+                           document_id: str, owner_id: str, conversation_id: str):
+        batch: List[ChunkRecord] = []
+        page_batch = []
+        page_number = 1
+        done = False
+
+        while not done:
+            page = await pages.get()
+            if page is _END:
+                done = True
+            else:
+                page_batch.append(page)
+            if not page_batch or (not done and len(page_batch) < self.split_pages):
+                continue
+
+            # Splitting is CPU bound, so it must not run on the event loop
+            chunks, tokens = await asyncio.to_thread(self._split_page_batch, page_batch, page_number,
+                                                     document_id, owner_id, conversation_id)
+            page_number += len(page_batch)
+            page_batch = []
+            result.total_number_of_chunks += len(chunks)
+            result.total_number_of_tokens += tokens
+
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    await batches.put(batch)
+                    batch = []
+
+        if batch:
+            await batches.put(batch)
+        for _ in range(self.workers):
+            await batches.put(_END)
+
+    def _split_page_batch(self, page_batch: list, first_page_number: int, document_id: str, owner_id: str,
+                          conversation_id: str):
+        page_chunks = self.text_splitter.split_pages(pages=page_batch,
+                                                     first_page_number=first_page_number,
+                                                     document_id=document_id,
+                                                     owner_id=owner_id,
+                                                     conversation_id=conversation_id)
+        chunks = [chunk for chunks in page_chunks for chunk in chunks]
+        return chunks, self.embedding_model.estimate_tokens_chunks(chunks)
+
+    async def _add_batches(self, batches: asyncio.Queue, written_ids: Set[str]):
+        while (batch := await batches.get()) is not _END:
+            # The ids are recorded before the upsert, a cancelled upsert may have been written anyway
+            point_ids = [chunk_point_id(chunk.metadata) for chunk in batch]
+            written_ids.update(point_ids)
+            report = await self.chunk_repository.add_chunks(chunks=batch, embedding_model=self.embedding_model)
+            # A failed batch was not written, each upsert request is applied as a whole
+            for failed_batch in report.failed_batches:
+                written_ids.difference_update(point_ids[failed_batch.start:failed_batch.stop])
+
+            # Check if the chunks were added successfully
+            if not report.success:
+                e = Exception(f"Internal server error: Could not add {report.number_of_failed_chunks} of "
+                              f"{len(batch)} chunks to the vector store: {report.failed_batches[0].error}")
+                raise HTTPInternalServerError(error=str(e))
@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.core.utils.logger import Logger
+
+load_dotenv()
+
+logger = Logger('Logger')
+
+# Forking the threaded server process can copy held locks into the workers, forkserver and spawn start clean
+PROCESS_POOL_START_METHOD = os.getenv("PROCESS_POOL_START_METHOD", "forkserver")
+
+_process_pools: Dict[str, ProcessPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def _ready():
+    pass
+
+
+def start_process_pool(name: str, max_workers: int, initializer: Optional[Callable] = None,
+                       initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    Starts the named process pool, or returns it if it is already running. The pools are started in the lifespan
+    of the app and shut down with shutdown_process_pools when it stops.
+    """
+    with _lock:
+        if name not in _process_pools:
+            context = multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=initializer,
+                                       initargs=initargs)
+            # The workers are started now instead of on the first task, so no request waits for them to boot
+            for _ in range(max_workers):
+                pool.submit(_ready)
+            _process_pools[name] = pool
+            logger.log(level="debug", func_name="start_process_pool",
+                       message=f"Started process pool {name} with {max_workers} workers")
+        return _process_pools[name]
+
+
+def get_process_pool(name: str) -> Optional[ProcessPoolExecutor]:
+    """The named process pool, None if it was not started."""
+    return _process_pools.get(name)
+
+
+def shutdown_process_pools(wait: bool = True):
+    with _lock:
+        pools = list(_process_pools.items())
+        _process_pools.clear()
+    for name, pool in pools:
+        pool.shutdown(wait=wait, cancel_futures=True)
+        logger.log(level="debug", func_name="shutdown_process_pools", message=f"Shut down process pool {name}")
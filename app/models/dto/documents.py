@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from pydantic import Field, BaseModel
 
@@ -31,3 +31,14 @@ class GetDocumentResponse(SuccessResponse):
 class GetDocumentsByIdResponse(SuccessResponse):
     document_id: str = Field(..., alias="documentId")
     document: List[ChunkModel]
+
+
+class DocumentChunk(BaseModel):
+    id: str | int
+    payload: Dict[str, Any]
+
+
+class GetDocumentChunksResponse(SuccessResponse):
+    chunks: List[DocumentChunk]
+    # Pass as offset to get the next page, None on the last page
+    next_page_offset: Optional[str | int] = Field(None, alias="nextPageOffset")
@@ -1,7 +1,14 @@
-from pydantic import BaseModel, Field
-from typing import List
+import os
 
-from app.core.domain.chunks.chunk_model import ChunkModel
+from pydantic import BaseModel, Field, PositiveInt
+from typing import List, Optional
+
+from app.core.domain.chunks.chunk_model import ChunkModel, ChunkSearchQuery
+
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", 1024))
+# Largest number of results of one search query, a batch of SEARCH_BATCH_MAX_QUERIES queries returns at most
+# SEARCH_BATCH_MAX_QUERIES * SEARCH_MAX_K documents
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", 100))
 
 
 class DocumentWithScore(ChunkModel):
@@ -11,3 +18,27 @@ class DocumentWithScore(ChunkModel):
 class SearchResponse(BaseModel):
     requestId: str
     related_documents: List[DocumentWithScore] = Field(..., alias="relatedDocuments")
+
+
+class BatchSearchQuery(BaseModel):
+    query: str = Field(..., min_length=1)
+    user_id: str = Field(..., alias="userId")
+    document_id: Optional[str] = Field(None, alias="documentId")
+    k: PositiveInt = Field(int(os.getenv("MAX_K_RESULTS")), le=SEARCH_MAX_K)
+
+    def to_chunk_search_query(self) -> ChunkSearchQuery:
+        return ChunkSearchQuery(query=self.query, user_id=self.user_id, document_id=self.document_id, k=self.k)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery] = Field(..., min_length=1, max_length=SEARCH_BATCH_MAX_QUERIES)
+
+
+class BatchSearchResult(BaseModel):
+    query: str
+    related_documents: List[DocumentWithScore] = Field(..., alias="relatedDocuments")
+
+
+class BatchSearchResponse(BaseModel):
+    requestId: str
+    results: List[BatchSearchResult]
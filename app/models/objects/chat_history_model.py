@@ -1,6 +1,9 @@
+import hashlib
+
 from pydantic import BaseModel
 from typing import List
 from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from app.core.domain.qa.qa_models import QAHistoryMessage
 
 
@@ -8,11 +11,22 @@ class ChatHistory(BaseModel):
     messages: List[QAHistoryMessage]
 
     def get_langchain_base_chat_message_history(self):
-        history = ChatMessageHistory()
+        return ChatMessageHistory(messages=self.to_langchain_messages())
+
+    def to_langchain_messages(self) -> List[BaseMessage]:
+        messages = []
         for msg in self.messages:
             if msg.role == 'user':
-                history.add_user_message(msg.content)
+                messages.append(HumanMessage(content=msg.content))
             elif msg.role == 'ai':
-                history.add_ai_message(msg.content)
-        return history
+                messages.append(AIMessage(content=msg.content))
+        return messages
 
+    def prefix_hashes(self) -> List[str]:
+        """Hash of every prefix of the history, the i-th hash covers the first i messages."""
+        digest = hashlib.sha256()
+        hashes = [digest.hexdigest()]
+        for msg in self.messages:
+            digest.update(f"{msg.role}\x00{msg.content}\x01".encode())
+            hashes.append(digest.copy().hexdigest())
+        return hashes
@@ -0,0 +1,107 @@
+"""
+Compares the cost of creating chunks on the ingestion path: validated pydantic ChunkModel objects, the previous
+chunks of the text splitter, with ChunkRecord and with ChunkModel.model_construct. Also compares clean_content with
+single pass alternatives and reports the memory of the created chunk objects.
+
+Usage: python -m benchmarks.chunk_model_benchmark --chunks 50000
+"""
+import argparse
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from app.core.domain.chunks.chunk_model import ChunkMetadata, ChunkModel, ChunkRecord, clean_content
+
+WORDS = ("the report shows that revenue increased in the third quarter while costs for materials and logistics "
+         "remained stable across all \"regions\" and business units of the company").split()
+
+
+def make_texts(chunks: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(chunks):
+        words = rng.choices(WORDS, k=rng.randint(40, 90))
+        for _ in range(rng.randint(1, 4)):
+            words.insert(rng.randint(1, len(words) - 1), "\n")
+        texts.append(" ".join(words))
+    return texts
+
+
+TRANSLATION = str.maketrans({"\n": " ", "\"": None})
+REPEATED_SPACES = re.compile(r" {2,}")
+
+
+def translate_clean(value: str) -> str:
+    return REPEATED_SPACES.sub(" ", value.translate(TRANSLATION))
+
+
+def regex_clean(value: str) -> str:
+    return REPEATED_SPACES.sub(" ", value.replace("\n", " ").replace("\"", ""))
+
+
+def validated_chunk(text: str, index: int) -> ChunkModel:
+    metadata = ChunkMetadata(document_id="document", conversation_id="conversation", owner_id="owner",
+                             page_number=1, on_page_index=index + 1)
+    return ChunkModel(content=text, metadata=metadata)
+
+
+def record_chunk(text: str, index: int) -> ChunkRecord:
+    return ChunkRecord.create(content=text, document_id="document", conversation_id="conversation",
+                              owner_id="owner", page_number=1, on_page_index=index + 1)
+
+
+def constructed_chunk(text: str, index: int) -> ChunkModel:
+    metadata = ChunkMetadata.model_construct(document_id="document", conversation_id="conversation",
+                                             owner_id="owner", page_number=1, on_page_index=index + 1)
+    return ChunkModel.model_construct(content=clean_content(text), metadata=metadata)
+
+
+def benchmark_cleaning(texts: list, repeat: int):
+    for label, clean in (("clean_content, chained str.replace", clean_content),
+                         ("str.translate and regex", translate_clean),
+                         ("str.replace and regex", regex_clean)):
+        seconds = min(timed(lambda: [clean(text) for text in texts]) for _ in range(repeat))
+        report(label, seconds, len(texts))
+
+
+def benchmark_chunks(texts: list, repeat: int):
+    for label, create in (("ChunkModel, validated", validated_chunk),
+                          ("ChunkRecord.create", record_chunk),
+                          ("ChunkModel.model_construct", constructed_chunk)):
+        seconds = min(timed(lambda: [create(text, index) for index, text in enumerate(texts)])
+                      for _ in range(repeat))
+        tracemalloc.start()
+        chunks = [create(text, index) for index, text in enumerate(texts)]
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Objects only, without the content strings
+        object_size = sys.getsizeof(chunks[0]) + sys.getsizeof(chunks[0].metadata)
+        report(label, seconds, len(texts), f"{allocated / 2 ** 20:7.1f} MiB allocated, {object_size} B per object")
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def report(label: str, seconds: float, chunks: int, extra: str = ""):
+    print(f"{label:<40} {seconds * 1000:8.1f} ms   {chunks / seconds:11.0f} chunks/s   {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = make_texts(args.chunks)
+    print(f"{args.chunks} chunks, {sum(map(len, texts)) / len(texts):.0f} characters per chunk")
+    benchmark_cleaning(texts, args.repeat)
+    benchmark_chunks(texts, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Runs the EmbeddingEngine against a local fake OpenAI embedding server and compares one batch at a time with
+concurrent batches. The server answers every request after a fixed latency and can reject every n-th request with
+429 Too Many Requests, which the engine must retry. The vectors of all runs are checked against the first run.
+
+The fake server returns a vector derived from the hash of each input, so the results are deterministic and any
+mix-up of batches or of the order within a batch shows up as a mismatch.
+
+Usage: python -m benchmarks.embedding_engine_benchmark --texts 5000 --latency 0.2 --concurrency 1 4 8 --reject-every 7
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the report shows that revenue increased in the third quarter while costs for materials and logistics "
+         "remained stable across all regions and business units of the company").split()
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """OpenAI compatible /embeddings endpoint on localhost."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float, dimensions: int, reject_every: int):
+        super().__init__(("127.0.0.1", 0), FakeEmbeddingHandler)
+        self.latency = latency
+        self.dimensions = dimensions
+        self.reject_every = reject_every
+        self.requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def vector(self, item) -> list:
+        digest = hashlib.sha256(json.dumps(item).encode()).digest()
+        values = struct.unpack(f"{len(digest) // 4}I", digest)
+        return [values[index % len(values)] / 2 ** 32 - 0.5 for index in range(self.dimensions)]
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    server: FakeEmbeddingServer
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            reject = self.server.reject_every and self.server.requests % self.server.reject_every == 0
+            if reject:
+                self.server.rejected += 1
+        time.sleep(self.server.latency)
+
+        if reject:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit"}})
+            return
+        # The client sends strings or, for known models, token arrays
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        self._send(200, {
+            "object": "list",
+            "model": body["model"],
+            "data": [{"object": "embedding", "index": index, "embedding": self.server.vector(item)}
+                     for index, item in enumerate(inputs)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_texts(count: int) -> list:
+    return [" ".join(WORDS[(index + offset) % len(WORDS)] for offset in range(60)) + f" {index}"
+            for index in range(count)]
+
+
+async def run(server: FakeEmbeddingServer, texts: list, concurrency: int, batch_texts: int) -> tuple:
+    from app.core.external_services.embedding.embedding_engine import EmbeddingEngine, EmbeddingRateLimiter
+    from app.core.external_services.embedding.openai_embedding_adapter import OpenAIEmbeddingModel
+
+    embedding_model = OpenAIEmbeddingModel(api_key="sk-" + "0" * 48, model_name="text-embedding-3-small",
+                                           dimensions=server.dimensions, base_url=server.base_url)
+    engine = EmbeddingEngine(embedding_model,
+                             max_batch_texts=batch_texts,
+                             retry_base_delay=0.05,
+                             rate_limiter=EmbeddingRateLimiter(concurrency=concurrency, tokens_per_minute=10 ** 9))
+    server.requests = server.rejected = 0
+    start = time.perf_counter()
+    vectors = await engine.embed(texts)
+    return vectors, time.perf_counter() - start
+
+
+def report(label: str, seconds: float, texts: int, server: FakeEmbeddingServer, correct: bool):
+    print(f"{label:<28} {seconds:7.2f} s   {texts / seconds:8.0f} texts/s   {server.requests:4d} requests   "
+          f"{server.rejected:3d} rejected   vectors {'ok' if correct else 'WRONG'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--batch-texts", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per request of the fake server")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--reject-every", type=int, default=7, help="Every n-th request gets a 429, 0 for none")
+    args = parser.parse_args()
+
+    # Every run must reach the server instead of the embedding cache
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+
+    server = FakeEmbeddingServer(args.latency, args.dimensions, args.reject_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    texts = make_texts(args.texts)
+    print(f"{args.texts} texts, {args.latency * 1000:.0f} ms per request, every {args.reject_every}. request rejected")
+
+    expected = None
+    try:
+        for concurrency in args.concurrency:
+            vectors, seconds = asyncio.run(run(server, texts, concurrency, args.batch_texts))
+            expected = expected or vectors
+            report(f"{concurrency} concurrent batch(es)", seconds, len(texts), server, vectors == expected)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares the MMR retriever of the langchain Qdrant store with QdrantMMRRetriever.
+
+The first part times the MMR selection alone for several fetch_k. The second part times both retrievers end to end
+on a throwaway collection with realistic payload sizes. The langchain retriever fetches vectors and payloads of all
+candidates, the QdrantMMRRetriever only fetches the payloads of the selected points.
+
+Usage: python -m benchmarks.mmr_benchmark --points 20000 --fetch-k 20 100
+
+Needs a running Qdrant at VECTOR_STORE_URL (or --url) for the second part, skip it with --selection-only. The
+collection is deleted afterwards.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+from langchain_qdrant import Qdrant
+from qdrant_client import models
+
+from app.core.domain.retriever.mmr_retriever import QdrantMMRRetriever, maximal_marginal_relevance
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
+
+COLLECTION_NAME = "benchmark_mmr"
+
+
+def report(label: str, values: list):
+    values = sorted(values)
+    print(f"{label:<40} mean {statistics.mean(values) * 1000:8.2f} ms   "
+          f"p95 {values[int(len(values) * 0.95)] * 1000:8.2f} ms")
+
+
+def benchmark_selection(fetch_ks: list, k: int, lambda_mult: float, dimensions: int, repetitions: int):
+    rng = np.random.default_rng(42)
+    for fetch_k in fetch_ks:
+        langchain_times, numpy_times = [], []
+        for _ in range(repetitions):
+            query = rng.standard_normal(dimensions).astype(np.float32)
+            candidates = rng.standard_normal((fetch_k, dimensions)).astype(np.float32)
+
+            start = time.perf_counter()
+            expected = langchain_mmr(query, candidates, lambda_mult=lambda_mult, k=k)
+            langchain_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            selected = maximal_marginal_relevance(query, candidates, k=k, lambda_mult=lambda_mult)
+            numpy_times.append(time.perf_counter() - start)
+
+            assert selected == expected, "Both implementations must select the same candidates"
+
+        report(f"selection langchain  fetch_k={fetch_k}", langchain_times)
+        report(f"selection vectorized fetch_k={fetch_k}", numpy_times)
+
+
+def fill_collection(vector_store: VectorStoreQdrant, embeddings, points: int, payload_bytes: int,
+                    batch_size: int = 500):
+    client = vector_store.get_client()
+    client.create_collection(collection_name=COLLECTION_NAME,
+                             vectors_config=models.VectorParams(size=embeddings.size,
+                                                                distance=models.Distance.COSINE))
+    for start in range(0, points, batch_size):
+        ids = list(range(start, min(start + batch_size, points)))
+        texts = [f"chunk {i} " + "lorem ipsum " * (payload_bytes // 12) for i in ids]
+        client.upsert(
+            collection_name=COLLECTION_NAME,
+            points=models.Batch(
+                ids=ids,
+                vectors=embeddings.embed_documents(texts),
+                payloads=[{"page_content": text,
+                           "metadata": {"owner_id": "owner", "document_id": "document", "conversation_id": "c",
+                                        "page_number": 1, "on_page_index": i + 1}} for i, text in zip(ids, texts)],
+            ),
+        )
+
+
+def benchmark_retrievers(vector_store: VectorStoreQdrant, embeddings, fetch_ks: list, k: int, lambda_mult: float,
+                         queries: int):
+    connection = Qdrant(client=vector_store.get_client(), collection_name=COLLECTION_NAME, embeddings=embeddings,
+                        metadata_payload_key="metadata")
+    for fetch_k in fetch_ks:
+        langchain_retriever = connection.as_retriever(search_type="mmr",
+                                                      search_kwargs={"k": k, "fetch_k": fetch_k,
+                                                                     "lambda_mult": lambda_mult})
+        retriever = QdrantMMRRetriever(client=vector_store.get_client(), async_client=None, embeddings=embeddings,
+                                       collection_name=COLLECTION_NAME, k=k, fetch_k=fetch_k,
+                                       lambda_mult=lambda_mult)
+        langchain_times, retriever_times = [], []
+        for i in range(queries):
+            query = f"query {i}"
+
+            start = time.perf_counter()
+            langchain_retriever.invoke(query)
+            langchain_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            retriever.invoke(query)
+            retriever_times.append(time.perf_counter() - start)
+
+        report(f"retriever langchain  fetch_k={fetch_k}", langchain_times)
+        report(f"retriever QdrantMMR  fetch_k={fetch_k}", retriever_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("VECTOR_STORE_URL", "http://localhost:6333"))
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--payload-bytes", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 50, 100, 200])
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--selection-only", action="store_true")
+    args = parser.parse_args()
+
+    benchmark_selection(args.fetch_k, args.k, args.lambda_mult, args.dimensions, args.queries)
+    if args.selection_only:
+        return
+
+    vector_store = VectorStoreQdrant(url=args.url)
+    client = vector_store.get_client()
+    if client.collection_exists(COLLECTION_NAME):
+        client.delete_collection(COLLECTION_NAME)
+
+    embeddings = DeterministicFakeEmbedding(size=args.dimensions)
+    try:
+        fill_collection(vector_store, embeddings, args.points, args.payload_bytes)
+        benchmark_retrievers(vector_store, embeddings, args.fetch_k, args.k, args.lambda_mult, args.queries)
+    finally:
+        client.delete_collection(COLLECTION_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Measures filtered search and filtered scroll latency of VectorStoreQdrant's payload indexes on throwaway collections:
+without indexes, with indexes added to the filled collection, as the migration does, and with indexes created with
+the collection before any point is inserted, as create_collection does. Only in the last case does Qdrant know the
+indexed fields while it builds the HNSW graph and add the filter-aware links for them.
+
+Usage: python -m benchmarks.payload_index_benchmark --points 200000 --owners 1000
+
+Needs a running Qdrant at VECTOR_STORE_URL (or --url). The collections are deleted afterwards.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import numpy as np
+from qdrant_client import models
+
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
+
+COLLECTION_NAME = "benchmark_payload_indexes"
+INDEXED_COLLECTION_NAME = "benchmark_payload_indexes_at_creation"
+
+
+def fill_collection(vector_store: VectorStoreQdrant, collection_name: str, points: int, owners: int,
+                    documents_per_owner: int, dimensions: int, indexes_first: bool = False, batch_size: int = 1000):
+    client = vector_store.get_client()
+    client.create_collection(collection_name=collection_name,
+                             vectors_config=models.VectorParams(size=dimensions, distance=models.Distance.COSINE))
+    if indexes_first:
+        vector_store.create_payload_indexes(collection_name)
+    rng = np.random.default_rng(42)
+
+    for start in range(0, points, batch_size):
+        ids = range(start, min(start + batch_size, points))
+        vectors = rng.random((len(ids), dimensions), dtype=np.float32)
+        client.upsert(
+            collection_name=collection_name,
+            points=models.Batch(
+                ids=list(ids),
+                vectors=vectors.tolist(),
+                payloads=[{"metadata": {"owner_id": f"owner-{i % owners}",
+                                        "document_id": f"document-{(i // owners) % documents_per_owner}",
+                                        "conversation_id": f"conversation-{i % owners}"}} for i in ids],
+            ),
+        )
+    wait_for_optimizers(vector_store, collection_name)
+
+
+def wait_for_optimizers(vector_store: VectorStoreQdrant, collection_name: str, timeout: float = 600):
+    """Waits until the HNSW graph is built, so the searches are not measured against unindexed segments."""
+    client = vector_store.get_client()
+    deadline = time.monotonic() + timeout
+    while client.get_collection(collection_name).status != models.CollectionStatus.GREEN:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Collection {collection_name} was not optimized within {timeout} s")
+        time.sleep(0.5)
+
+
+def owner_filter(owner: int, document: int) -> models.Filter:
+    return models.Filter(must=[
+        models.FieldCondition(key="metadata.owner_id", match=models.MatchValue(value=f"owner-{owner}")),
+        models.FieldCondition(key="metadata.document_id", match=models.MatchValue(value=f"document-{document}")),
+    ])
+
+
+def measure(vector_store: VectorStoreQdrant, collection_name: str, queries: int, owners: int,
+            documents_per_owner: int, dimensions: int) -> dict:
+    client = vector_store.get_client()
+    rng = np.random.default_rng(7)
+    search_times, scroll_times = [], []
+
+    for _ in range(queries):
+        query_filter = owner_filter(int(rng.integers(owners)), int(rng.integers(documents_per_owner)))
+
+        start = time.perf_counter()
+        client.search(collection_name=collection_name, query_vector=rng.random(dimensions).tolist(),
+                      query_filter=query_filter, limit=5)
+        search_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        client.scroll(collection_name=collection_name, scroll_filter=query_filter, limit=100)
+        scroll_times.append(time.perf_counter() - start)
+
+    return {"search": search_times, "scroll": scroll_times}
+
+
+def report(label: str, times: dict):
+    for operation, values in times.items():
+        values = sorted(values)
+        print(f"{label:<20} {operation:<8} mean {statistics.mean(values) * 1000:8.2f} ms   "
+              f"p95 {values[int(len(values) * 0.95)] * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("VECTOR_STORE_URL", "http://localhost:6333"))
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--owners", type=int, default=500)
+    parser.add_argument("--documents-per-owner", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    vector_store = VectorStoreQdrant(url=args.url)
+    client = vector_store.get_client()
+    for collection_name in (COLLECTION_NAME, INDEXED_COLLECTION_NAME):
+        if client.collection_exists(collection_name):
+            client.delete_collection(collection_name)
+    sizes = (args.queries, args.owners, args.documents_per_owner, args.dimensions)
+
+    try:
+        fill_collection(vector_store, COLLECTION_NAME, args.points, args.owners, args.documents_per_owner,
+                        args.dimensions)
+        without_indexes = measure(vector_store, COLLECTION_NAME, *sizes)
+
+        vector_store.create_payload_indexes(COLLECTION_NAME)
+        wait_for_optimizers(vector_store, COLLECTION_NAME)
+        indexes_added = measure(vector_store, COLLECTION_NAME, *sizes)
+
+        fill_collection(vector_store, INDEXED_COLLECTION_NAME, args.points, args.owners, args.documents_per_owner,
+                        args.dimensions, indexes_first=True)
+        indexes_at_creation = measure(vector_store, INDEXED_COLLECTION_NAME, *sizes)
+
+        report("without indexes", without_indexes)
+        report("indexes added", indexes_added)
+        report("indexes at creation", indexes_at_creation)
+    finally:
+        for collection_name in (COLLECTION_NAME, INDEXED_COLLECTION_NAME):
+            if client.collection_exists(collection_name):
+                client.delete_collection(collection_name)
+        asyncio.run(vector_store.close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares the text splitter modes on a synthetic corpus with the previous splitter, a new langchain SpacyTextSplitter
+per upload that splits page by page.
+
+Every mode is timed twice: the first upload includes loading the pipeline, the second one reuses it like all later
+uploads of the process. The spacy and sentencizer modes are also timed with a process pool.
+
+Usage: python -m benchmarks.text_splitter_benchmark --pages 500 --processes 1 4
+
+Needs spacy and en_core_web_sm for the spacy modes, with --modes regex only the regex mode runs.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from app.core.domain.upload.sentence_splitter import SentenceSplitter
+from app.core.domain.upload.text_splitter_service import TextSplitterService
+from app.core.utils.process_pools import shutdown_process_pools
+
+WORDS = ("the report shows that revenue increased in the third quarter while costs for materials and logistics "
+         "remained stable across all regions and business units of the company").split()
+ABBREVIATIONS = ("e.g.", "i.e.", "approx.", "no.")
+
+
+def make_corpus(pages: int, sentences_per_page: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    corpus = []
+    for page_number in range(pages):
+        paragraphs = []
+        for _ in range(sentences_per_page // 6):
+            sentences = []
+            for _ in range(6):
+                words = rng.choices(WORDS, k=rng.randint(8, 30))
+                if rng.random() < 0.2:
+                    words.insert(rng.randint(1, len(words) - 1), rng.choice(ABBREVIATIONS))
+                sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+            paragraphs.append(" ".join(sentences))
+        corpus.append(Document(page_content="\n\n".join(paragraphs), metadata={"page": page_number}))
+    return corpus
+
+
+def split(splitter: TextSplitterService, corpus: list) -> int:
+    return len(splitter.split_text(corpus, document_id="document", owner_id="owner", conversation_id="c"))
+
+
+def benchmark_previous(corpus: list, chunk_size: int):
+    from langchain_text_splitters import SpacyTextSplitter
+
+    for run in ("first upload", "next upload"):
+        start = time.perf_counter()
+        splitter = SpacyTextSplitter(chunk_size=chunk_size)
+        chunks = sum(len(splitter.split_text(page.page_content)) for page in corpus)
+        report(f"previous SpacyTextSplitter, {run}", time.perf_counter() - start, len(corpus), chunks)
+
+
+def benchmark_mode(corpus: list, chunk_size: int, mode: str, processes: int):
+    for run in ("first upload", "next upload"):
+        start = time.perf_counter()
+        splitter = TextSplitterService(chunk_size=chunk_size, mode=mode)
+        splitter.sentence_splitter = SentenceSplitter(mode=mode, processes=processes, parallel_page_threshold=1)
+        # Like the app, which starts the pool in its lifespan, the first upload includes starting the workers
+        splitter.start_process_pool()
+        chunks = split(splitter, corpus)
+        report(f"{mode}, {processes} process(es), {run}", time.perf_counter() - start, len(corpus), chunks)
+    shutdown_process_pools()
+
+
+def report(label: str, seconds: float, pages: int, chunks: int):
+    print(f"{label:<50} {seconds:8.2f} s   {pages / seconds:9.1f} pages/s   {chunks:6d} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--sentences-per-page", type=int, default=30)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--modes", nargs="+", default=["spacy", "sentencizer", "regex"])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--skip-previous", action="store_true")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.pages, args.sentences_per_page)
+    print(f"{args.pages} pages, {statistics.mean(len(page.page_content) for page in corpus):.0f} characters per page")
+
+    if not args.skip_previous and "spacy" in args.modes:
+        benchmark_previous(corpus, args.chunk_size)
+    for mode in args.modes:
+        # Regex splitting always runs in the calling process
+        for processes in ([1] if mode == "regex" else args.processes):
+            benchmark_mode(corpus, args.chunk_size, mode, processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,36 @@
 # main.py
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from app.api.v1 import qa, chunks, collections
+from app.api.v1.chunks import get_text_splitter
+from app.core.domain.retriever.reranker import CrossEncoderReranker, reranker_available
+from app.core.domain.upload.pdf_reader_service import PDFReaderService
+from app.core.external_services.database.vector_store.qdrant_vector_adapter import VectorStoreQdrant
+from app.core.utils.process_pools import shutdown_process_pools
 from app.exceptions.http_exceptions import HTTPInternalServerError
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled vector store for the whole process, shared by all routers
+    vector_store = VectorStoreQdrant()
+    vector_store.startup()
+    app.state.vector_store = vector_store
+    # Load the spaCy pipeline or tokenizer of the text splitter before the first upload
+    get_text_splitter().warm_up()
+    if reranker_available():
+        CrossEncoderReranker().warm_up()
+    # Worker processes for large PDFs and page batches, started before the server handles requests on other threads
+    PDFReaderService.start_process_pool()
+    get_text_splitter().start_process_pool()
+    yield
+    shutdown_process_pools()
+    await vector_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.exception_handler(HTTPInternalServerError)